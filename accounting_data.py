@@ -1,13 +1,86 @@
 # Here we collect all functions concerning accounting data, which is the result of reading transactions
-# from a CSV-file. Accounting data is a list of dictionaries where each dictionary is formatted as
+# from a CSV-file. Accounting data is a list of Transaction records (see below) which can be indexed like
+# dictionaries with the keys
 # 'date_book', 'date_rent', 'account_to', 'type', 'text', 'out', 'in'
 
-from aux_functions import matchesAnyOne, formatNumber, eprint
+from aux_functions import RegexMatcher, formatNumber, eprint
+from collections import deque
 from datetime import datetime
 from tabulate import tabulate
+import time
+import sys
 import csv
 
 
+# ----------------------------------------------------------------------------------
+# Transaction class
+# ----------------------------------------------------------------------------------
+
+# Compact record of a single transaction. Uses __slots__ instead of a per-instance dictionary, which makes each
+# transaction take up a fraction of the memory of an equivalent dictionary. The fields can still be read
+# and written using the old dictionary keys, e.g. transaction['out']. The amounts are stored as integer øre
+# (1/100 NOK) in out_ore and in_ore, while 'out' and 'in' give the amounts in NOK as floating point numbers.
+class Transaction:
+    __slots__ = ('date_book', 'date_rent', 'account_to', 'tr_type', 'text', 'out_ore', 'in_ore', 'archive_ref',\
+            'category', 'skipped')
+
+    # Maps the dictionary keys used in the results files to the attribute names.
+    KEYS = {'date_book' : 'date_book', 'date_rent' : 'date_rent', 'account_to' : 'account_to', 'type' : 'tr_type',\
+            'text' : 'text', 'out' : 'tr_out', 'in' : 'tr_in', 'archive_ref' : 'archive_ref'}
+
+    def __init__(self, date_book, date_rent, account_to, tr_type, text, out_ore, in_ore, archive_ref = ''):
+        self.date_book = date_book
+        self.date_rent = date_rent
+        self.account_to = account_to
+        self.tr_type = tr_type
+        self.text = text
+        self.out_ore = out_ore
+        self.in_ore = in_ore
+        self.archive_ref = archive_ref
+        # The classification of the transaction, which is tagged the first time it is needed so that the regexes
+        # are only run once for each transaction. category is the name of the category the transaction has been
+        # put in, and skipped tells if it matches the skip regexes (None until this has been determined). These
+        # are not part of the results files.
+        self.category = None
+        self.skipped = None
+
+    @property
+    def tr_out(self):
+        return self.out_ore / 100
+
+    @tr_out.setter
+    def tr_out(self, value):
+        self.out_ore = round(value * 100)
+
+    @property
+    def tr_in(self):
+        return self.in_ore / 100
+
+    @tr_in.setter
+    def tr_in(self, value):
+        self.in_ore = round(value * 100)
+
+    def __getitem__(self, key):
+        return getattr(self, Transaction.KEYS[key])
+
+    def __setitem__(self, key, value):
+        setattr(self, Transaction.KEYS[key], value)
+
+    def __str__(self):
+        return str(self.makeDict())
+
+    # Returns the transaction as a dictionary following the format of the results files.
+    def makeDict(self):
+        return {key : getattr(self, attribute) for key, attribute in Transaction.KEYS.items()}
+
+# Creates a Transaction from a dictionary with the keys 'date_book', 'date_rent', 'account_to', 'type', 'text',
+# 'out', 'in' and optionally 'archive_ref', e.g. a transaction loaded from a results file. Results files saved before
+# the archive reference was stored get an empty archive reference.
+def transactionFromDict(dic):
+    return Transaction(dic['date_book'], dic['date_rent'], dic['account_to'], dic['type'], dic['text'],\
+            round(dic['out'] * 100), round(dic['in'] * 100), dic.get('archive_ref', ''))
+
+
 # ----------------------------------------------------------------------------------
 # Creation functions
 # ----------------------------------------------------------------------------------
@@ -30,17 +103,54 @@ def csvFileToLists(file_path, encoding="ISO-8859-1"):
     # Return lists
     return (header, column_names, account_data, footer)
 
+# Check that the header line of an account CSV file looks like the ones exported from Sbanken.
+def validateCSVHeader(header):
+    return len(header) > 5 and len(header[5]) == 25 and header[0] == ''
+
 # Take in the list structure of an account CSV file and check that our assumptions are correct
 # Return true if the lists are valid.
 def validateCSVLists(header, column_names, account_data, footer):
     valid = True
     # Checking header list
-    valid = valid and (len(header[5]) == 25 and header[0] == '')
+    valid = valid and validateCSVHeader(header)
     # Checking account_data
     valid = valid and len(account_data) > 0
     return valid
 
 
+# Cache of the dates parsed by parseDate. Many transactions share the same booking date, so most dates are only
+# parsed once.
+date_memo = {}
+
+# Parses a date string on the format YYYY-mm-dd into a datetime object. This is much faster than datetime.strptime
+# since the format is fixed. Falls back to strptime for strings that do not follow the format, so that these
+# raise the usual errors.
+def parseDate(date_string):
+    date = date_memo.get(date_string)
+    if date is None:
+        if len(date_string) == 10 and date_string[4] == '-' and date_string[7] == '-'\
+                and date_string[:4].isdigit() and date_string[5:7].isdigit() and date_string[8:].isdigit():
+            date = datetime(int(date_string[:4]), int(date_string[5:7]), int(date_string[8:]))
+        else:
+            date = datetime.strptime(date_string, "%Y-%m-%d")
+        date_memo[date_string] = date
+    return date
+
+# Takes a string representing money with a comma as decimal separator, e.g. '1234,5', and returns the amount as
+# an integer number of øre without going through a floating point number.
+def parseMoneyToOre(money_string):
+    if money_string == '':
+        return 0
+    kroner, _, decimals = money_string.partition(',')
+    negative = kroner.startswith('-')
+    if negative:
+        kroner = kroner[1:]
+    if kroner.isdigit() and len(decimals) <= 2 and (decimals == '' or decimals.isdigit()):
+        ore = int(kroner) * 100 + int(decimals.ljust(2, '0'))
+        return -ore if negative else ore
+    # Unusual formats, e.g. more than two decimals, are handled by the slower floating point path.
+    return round(formatMoney(money_string) * 100)
+
 # Takes a string representing money and returns the floating point value
 def formatMoney(money_string):
     if money_string != '':
@@ -49,7 +159,8 @@ def formatMoney(money_string):
         return 0.0
 
 # Formats the elements of a accounting_data list into the correct formats (see structureAcocuntDataToDicts
-# for explanation).
+# for explanation). This uses the general purpose parsers and is kept as the reference for the fast path in
+# parseAccountingListLine (see benchmarkLineParsing).
 def formatAccountingListLine(line):
     date_format = "%Y-%m-%d"
     date_book = datetime.strptime(line[0], date_format)
@@ -66,23 +177,24 @@ def formatAccountingListLine(line):
 
 # Takes in account_data in the form of a list of lists which has been imported from a csv file. Each element in
 # the outer list contains a list of 8 elements: date_booked, date_rent, archive_ref, account_to, type, text,
-# out, and in. These elements are structured as dicts where we store the fields
+# out, and in. These elements are structured as Transaction records where we store the fields
 # 'date_book', 'date_rent', 'account_to', 'type', 'text', 'out', 'in'
 # The values are also deserialized into their respective python data-types.
 def structureAccountDataToDicts(account_data):
-    dicts = []
+    return [structureAccountLine(line) for line in account_data]
 
-    for line in account_data:
-        formatted_list = formatAccountingListLine(line)
-        dict_line = { 'date_book': formatted_list[0], 'date_rent' : formatted_list[1],\
-                'account_to' : formatted_list[2], 'type' : formatted_list[3], 'text' : formatted_list[4],\
-                'out' : formatted_list[5], 'in' : formatted_list[6] }
-        dicts.append(dict_line)
+# Parses the elements of a single line of account data directly into a Transaction using the fixed format
+# parsers parseDate and parseMoneyToOre.
+def parseAccountingListLine(line):
+    return Transaction(parseDate(line[0]), parseDate(line[1]), line[3], line[4], line[5],\
+            parseMoneyToOre(line[6]), parseMoneyToOre(line[7]), line[2])
 
-    return dicts
+# Structures a single line of account data as a Transaction (see structureAccountDataToDicts).
+def structureAccountLine(line):
+    return parseAccountingListLine(line)
 
 #We assume that the file path contains a valid CSV file and try to read it into a python list.
-# This list is formatted so that each element is a dictionary containing the fields
+# This list is formatted so that each element is a Transaction containing the fields
 #
 # 'date_book', 'date_rent', 'account_to', 'type', 'text', 'out', 'in'
 #
@@ -98,21 +210,47 @@ def readCSVAccountFile(file_path, encoding = "ISO-8859-1"):
 
     return structureAccountDataToDicts(account_data)
 
-# Takes a completed list of dictionaries and checks that they have the correct data types for all elements.
+# Streaming version of csvFileToLists. Reads the CSV file line by line and yields the account data lines
+# one at a time, so that only a few lines are held in memory no matter how large the file is. The header
+# is validated before any lines are yielded, and the trailing footer lines are held back in a small lookahead
+# buffer so that they are never yielded.
+def iterCSVAccountLines(file_path, encoding="ISO-8859-1", footer_length=2):
+    with open(file_path, "r", newline='', encoding=encoding) as f:
+        reader = csv.reader(f, delimiter=';')
+        header = next(reader, [])
+        next(reader, None)
+        next(reader, None) # Column names
+        if not validateCSVHeader(header):
+            raise Exception(f"ERROR: Invalid format of header read from {file_path}!")
+
+        lookahead = deque()
+        for line in reader:
+            lookahead.append(line)
+            if len(lookahead) > footer_length:
+                yield lookahead.popleft()
+    return
+
+# Lazily reads the CSV file in file_path and yields one Transaction at a time, formatted as in
+# readCSVAccountFile.
+def iterAccountingData(file_path, encoding="ISO-8859-1"):
+    for line in iterCSVAccountLines(file_path, encoding=encoding):
+        yield structureAccountLine(line)
+    return
+
+# Takes a single transaction and checks that it has the correct data types for all elements.
+def validTransaction(dic):
+    return isinstance(dic['date_book'], datetime) and isinstance(dic['date_rent'], datetime)\
+            and isinstance(dic['account_to'], str) and isinstance(dic['type'], str)\
+            and isinstance(dic['text'], str) and isinstance(dic['out'], float) and isinstance(dic['in'], float)
+
+# Takes a completed list of transactions and checks that they have the correct data types for all elements.
 def validateAccountingData(accounting_data):
     valid = True
-    first_element_month = accounting_data[0]['date_book'].month
     for dic in accounting_data:
         # Checking data-types
-        if not (isinstance(dic['date_book'], datetime) and isinstance(dic['date_rent'], datetime)\
-                and isinstance(dic['account_to'], str) and isinstance(dic['type'], str)\
-                and isinstance(dic['text'], str) and isinstance(dic['out'], float) and isinstance(dic['in'], float)):
+        if not validTransaction(dic):
             valid = False
             eprint(f"Error importing {dic}")
-        # Checking if the element if in the same month as the first
-        if not dic['date_book'].month == first_element_month:
-            valid = False
-            eprint(f"Date of {dic} does not match the first element's month")
     return valid
 
 def importAndValidateCSV(path):
@@ -127,17 +265,147 @@ def importAndValidateCSV(path):
 
     return accounting_data
 
+# Streaming version of importAndValidateCSV. Returns a MonthlyTallies object together with a generator yielding
+# the transactions in the file. The tallies validate and summarize the transactions of each month as they are
+# pulled through the generator, so their results are only complete once the generator has been exhausted.
+# If a transaction index is given (see transaction_index.py), transactions that have already been imported are
+# left out.
+def streamAndValidateCSV(path, settings_dict, index=None):
+    return streamAndValidateTransactions(iterAccountingData(path), settings_dict, index=index)
+
+# Does the same as streamAndValidateCSV for transactions from another source, e.g. the Sbanken API (see
+# sbanken_sync.py), given as an iterable of Transactions. If a skip matcher is given (see MonthlyTallies), it is used
+# to leave skipped transactions out of the income.
+def streamAndValidateTransactions(accounting_data, settings_dict, index=None, skip_matcher=None):
+    tallies = MonthlyTallies(settings_dict, skip_matcher)
+    if index != None:
+        accounting_data = index.filterNew(accounting_data)
+    return tallies, tallies.track(accounting_data)
+
 
 
 # ----------------------------------------------------------------------------------
 # Processing functions
 # ----------------------------------------------------------------------------------
 
+# Keeps running totals of accounting data that is streamed through it, so that the transactions themselves
+# do not have to be kept in memory. Keeps track of the income sum (excluding transactions matching the skip
+# regexes), the income transactions themselves, the first and last booking dates, the number of transactions
+# and whether all transactions were valid and in the same month. The skip matcher is given with the transactions
+# instead of being kept in the tally, since the tallies are sent back from the worker processes.
+class AccountingTally:
+    def __init__(self):
+        self.sum_in = 0.0
+        self.income_list = []
+        self.start_date = None
+        self.end_date = None
+        self.count = 0
+        self.valid = True
+
+    # Update the tally with a single transaction.
+    def add(self, line, skip_matcher):
+        if not validTransaction(line):
+            self.valid = False
+            eprint(f"Error importing {line}")
+            return
+
+        date = line['date_book']
+        if self.count == 0:
+            self.start_date = date
+            self.end_date = date
+        elif date.month != self.start_date.month or date.year != self.start_date.year:
+            self.valid = False
+            eprint(f"Date of {line} does not match the first element's month")
+        self.start_date = min(self.start_date, date)
+        self.end_date = max(self.end_date, date)
+        self.count += 1
+
+        if line['in'] > 0 and (not isSkipped(line, skip_matcher)):
+            self.sum_in += line['in']
+            self.income_list.append(line)
+        return
+
+    # Generator passing the transactions in accounting_data through while adding them to the tally.
+    def track(self, accounting_data, skip_matcher):
+        for line in accounting_data:
+            self.add(line, skip_matcher)
+            yield line
+        return
+
+    # Adds the totals of another tally to this one. Both tallies are expected to cover the same month.
+    def merge(self, other):
+        if other.count == 0:
+            self.valid = self.valid and other.valid
+            return
+        if self.count == 0:
+            self.start_date = other.start_date
+            self.end_date = other.end_date
+        elif other.start_date.month != self.start_date.month or other.start_date.year != self.start_date.year:
+            self.valid = False
+            eprint(f"Cannot merge tallies of different months {self.start_date} and {other.start_date}")
+        self.start_date = min(self.start_date, other.start_date)
+        self.end_date = max(self.end_date, other.end_date)
+        self.sum_in += other.sum_in
+        self.income_list += other.income_list
+        self.count += other.count
+        self.valid = self.valid and other.valid
+        return
+
+    # Returns True if the tally has seen at least one transaction and all of them were valid.
+    def isValid(self):
+        return self.valid and self.count > 0
+
+# Keeps one AccountingTally for each month of the accounting data streamed through it, so that data spanning
+# several months can be split into months in a single pass. The tallies are stored in the dictionary tallies
+# with the month of the booking date (see getMonthKey) as keys. The skip matcher can be any object with a matches
+# method like RegexMatcher, e.g. a categories_dictionary.CategoryMatcher, and is shared by all the tallies.
+class MonthlyTallies:
+    def __init__(self, settings_dict, skip_matcher=None):
+        self.skip_matcher = skip_matcher if skip_matcher != None else RegexMatcher(settings_dict['skip_regexes'])
+        self.tallies = {}
+        self.valid = True
+
+    # Update the tally of the transaction's month with a single transaction.
+    def add(self, line):
+        if not isinstance(line['date_book'], datetime):
+            self.valid = False
+            eprint(f"Error importing {line}")
+            return
+        month = getMonthKey(line['date_book'])
+        if month not in self.tallies:
+            self.tallies[month] = AccountingTally()
+        self.tallies[month].add(line, self.skip_matcher)
+        return
+
+    # Generator passing the transactions in accounting_data through while adding them to the tallies.
+    def track(self, accounting_data):
+        for line in accounting_data:
+            self.add(line)
+            yield line
+        return
+
+    # Returns True if all the tallies are valid. Note that this is also the case if no transactions have been seen,
+    # e.g. if all of them had already been imported.
+    def isValid(self):
+        return self.valid and all([tally.isValid() for tally in self.tallies.values()])
+
+# Returns the month of a date as a string formatted as YYYY-mm, used to split accounting data into months.
+def getMonthKey(date):
+    return f"{date.year:04d}-{date.month:02d}"
+
+# Returns True if a transaction matches any of the skip regexes in skip_matcher. The verdict is tagged on the
+# transaction, so the regexes are only run the first time.
+def isSkipped(line, skip_matcher):
+    if line.skipped == None:
+        line.skipped = skip_matcher.matches(line.text)
+    return line.skipped
+
 # Sums all income listed in accounting data except for trasactions that match the skip-patterns from settings
 def sumIncome(accounting_data, settings_dict):
+    skip_matcher = RegexMatcher(settings_dict['skip_regexes'])
     total = 0.0
     for line in accounting_data:
-        if line['in'] > 0 and (not matchesAnyOne(settings_dict['skip_regexes'], line['text'])):
+        if line['in'] > 0 and (not isSkipped(line, skip_matcher)):
             total += line['in']
     return total
 
@@ -148,7 +416,8 @@ def sumIncome(accounting_data, settings_dict):
 
 # Print all income transactions nicely that are not excluded by the skip regexes.
 def printIncome(accounting_data, settings_dict):
-    data = [[trans['date_book'].strftime('%Y-%m-%d'), formatNumber(trans['in']), trans['text']] for trans in accounting_data if trans['in'] > 0 and (not matchesAnyOne(settings_dict['skip_regexes'], trans['text']))]
+    skip_matcher = RegexMatcher(settings_dict['skip_regexes'])
+    data = [[trans['date_book'].strftime('%Y-%m-%d'), formatNumber(trans['in']), trans['text']] for trans in accounting_data if trans['in'] > 0 and (not isSkipped(trans, skip_matcher))]
     headers = ["Date Booked", "In", "Comment"]
     print(tabulate(data, headers=headers, colalign=("left", "right", "left"), disable_numparse=True, tablefmt="rst"))
     return
@@ -159,3 +428,58 @@ def getTransactionDates(accounting_data):
 
 
 
+# ----------------------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------------------
+
+# Generates n_rows synthetic lines of account data spread over n_days different dates.
+def generateAccountLines(n_rows, n_days = 365):
+    start = datetime(2023, 1, 1).toordinal()
+    dates = [datetime.fromordinal(start + day).strftime("%Y-%m-%d") for day in range(n_days)]
+    lines = []
+    for i in range(n_rows):
+        date = dates[(i * 7) % n_days]
+        amount = f"{(i * 37) % 5000},{i % 100:02d}"
+        if i % 10 == 0:
+            lines.append([date, date, str(i), '', 'Overføring', 'Lønn', '', amount])
+        else:
+            lines.append([date, date, str(i), '', 'Varekjøp', f'REMA 1000 {i % 50}', amount, ''])
+    return lines
+
+# Times the reference path using strptime and float parsing against the fixed format parser on synthetic
+# account data and checks that the two give the same results.
+def benchmarkLineParsing(n_rows = 200000):
+    lines = generateAccountLines(n_rows)
+
+    start = time.perf_counter()
+    reference = [formatAccountingListLine(line) for line in lines]
+    reference_time = time.perf_counter() - start
+
+    date_memo.clear()
+    start = time.perf_counter()
+    fast = [parseAccountingListLine(line) for line in lines]
+    fast_time = time.perf_counter() - start
+
+    for ref, trans in zip(reference, fast):
+        if ref != [trans['date_book'], trans['date_rent'], trans['account_to'], trans['type'], trans['text'],\
+                trans['out'], trans['in']]:
+            raise Exception(f"ERROR: Parsers disagree on {ref} and {trans}")
+
+    headers = ["Parser", "Time [s]", "Rows / s"]
+    data = [["strptime / float", round(reference_time, 3), round(n_rows / reference_time)],\
+            ["fixed format", round(fast_time, 3), round(n_rows / fast_time)]]
+    print(f"Parsing {n_rows} rows:")
+    print(tabulate(data, headers=headers, disable_numparse=True, tablefmt="rst"))
+    print(f"Speedup: {round(reference_time / fast_time, 1)}x")
+    return
+
+# Running this file runs the benchmark. An optional argument gives the number of rows to parse.
+def main(argv):
+    if len(argv) > 0:
+        benchmarkLineParsing(int(argv[0]))
+    else:
+        benchmarkLineParsing()
+    return
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,81 @@
+# Implementation of the Aho-Corasick multi-pattern string matching automaton. All the words added to the automaton
+# are searched for in a single pass through a text, so that the time it takes to search a text depends on the
+# length of the text and not on the number of words.
+#
+# Each word is stored with a value, and a search returns the smallest value of the words found in the text. This is
+# used to find the first category (in the order of the settings) with a literal pattern contained in a transaction
+# text.
+
+class AhoCorasick:
+    def __init__(self):
+        # The automaton is stored as lists indexed by node number, where node 0 is the root.
+        # goto: dictionaries of the transitions from each node to the next node for each character.
+        # fail: the node corresponding to the longest proper suffix of each node that is also in the trie.
+        # values: the smallest value of the words ending at each node or at any of its suffixes.
+        self.goto = [{}]
+        self.fail = [0]
+        self.values = [None]
+        self.built = True
+
+    # Adds a word with a value to the automaton. If the word is added several times, the smallest value is kept.
+    def add(self, word, value):
+        node = 0
+        for char in word:
+            next_node = self.goto[node].get(char)
+            if next_node == None:
+                next_node = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.values.append(None)
+                self.goto[node][char] = next_node
+            node = next_node
+        self.values[node] = minValue(self.values[node], value)
+        self.built = False
+        return
+
+    # Computes the failure links by a breadth first traversal of the trie. Must be called after adding words and
+    # before searching.
+    def build(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            self.fail[node] = 0
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for char, next_node in self.goto[node].items():
+                fail = self.fail[node]
+                while fail != 0 and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_node] = self.goto[fail].get(char, 0)
+                # The failure link points to a node closer to the root, which has already been processed.
+                self.values[next_node] = minValue(self.values[next_node], self.values[self.fail[next_node]])
+                queue.append(next_node)
+        self.built = True
+        return
+
+    # Returns the smallest value of the words contained in text, or None if it contains none of them.
+    def minimumValue(self, text):
+        if not self.built:
+            self.build()
+        goto = self.goto
+        fail = self.fail
+        values = self.values
+        node = 0
+        best = None
+        for char in text:
+            while node != 0 and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            value = values[node]
+            if value != None and (best == None or value < best):
+                best = value
+        return best
+
+# Returns the smallest of two values where None means no value.
+def minValue(a, b):
+    if a == None:
+        return b
+    if b == None:
+        return a
+    return min(a, b)
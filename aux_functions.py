@@ -2,6 +2,8 @@ import sys
 import re
 import os
 import json
+import stat
+import threading
 
 # Function for printing to stderr
 def eprint(*args, **kwargs):
@@ -9,21 +11,143 @@ def eprint(*args, **kwargs):
 
 # Check if any of the regex expressions in a list has any match in a string.
 # Return True / False
-def matchesAnyOne(regex_list, string):
+# If a profiler (see rule_profiler.py) is given, each search is recorded in it under the name group.
+def matchesAnyOne(regex_list, string, profiler=None, group=None):
+    lowered = string.lower()
+    if profiler != None:
+        for regex in regex_list:
+            if profiler.search(group, regex, lowered):
+                return True
+        return False
+
     for regex in regex_list:
-        if re.search(regex, string.lower()):
+        if re.search(regex, lowered):
             return True
     return False
 
+# Precompiled version of matchesAnyOne. The regex expressions in the list are compiled once into a single
+# alternation, so that checking a string only requires one search. Patterns that can not be part of an
+# alternation, like patterns with back-references or global flags, are compiled separately.
+class RegexMatcher:
+    def __init__(self, regex_list):
+        self.regex_list = list(regex_list)
+        self.patterns = []
+
+        combinable = [regex for regex in self.regex_list if not re.search(r'\\[1-9]|\(\?P=', regex)]
+        separate = [regex for regex in self.regex_list if regex not in combinable]
+        if len(combinable) > 0:
+            try:
+                self.patterns.append(re.compile('|'.join([f'(?:{regex})' for regex in combinable])))
+            except re.error:
+                separate = self.regex_list
+        self.patterns += [re.compile(regex) for regex in separate]
+
+    # Returns True if any of the regex expressions match the string, which is assumed to already be in lower case.
+    def matchesLowered(self, lowered):
+        for pattern in self.patterns:
+            if pattern.search(lowered):
+                return True
+        return False
+
+    # Returns True if any of the regex expressions match the string (see matchesAnyOne).
+    def matches(self, string):
+        return self.matchesLowered(string.lower())
+
+
+# Characters with a special meaning in regex patterns when they are not escaped.
+REGEX_SPECIAL_CHARACTERS = set('.^$*+?{}[]|()')
+
+# If a regex pattern only matches a fixed string, e.g. "rema" or "komplett\\.no", this string is returned.
+# Otherwise None is returned. Escaped characters that are not letters or digits are part of the fixed string,
+# while escape sequences like \\s or \\d and unescaped special characters make the pattern a real regex.
+def literalFromRegex(regex):
+    chars = []
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '\\':
+            if i + 1 >= len(regex) or regex[i + 1].isalnum() or regex[i + 1] == '_':
+                return None
+            chars.append(regex[i + 1])
+            i += 2
+            continue
+        if char in REGEX_SPECIAL_CHARACTERS:
+            return None
+        chars.append(char)
+        i += 1
+    if len(chars) == 0:
+        return None
+    return ''.join(chars)
+
+# Escape sequences that match digits, or characters next to them.
+DIGIT_ESCAPES = set('dDwWSbB')
+
+# Returns True if no part of a regex pattern can match a digit or depends on the digits around it. Such a pattern
+# matches a text exactly when it matches the text with its numbers replaced by other numbers, since all its matches
+# lie between the numbers. Digits anywhere in the pattern, e.g. in "rema 1000" or a quantifier like {2}, and
+# patterns with '.' or character classes are treated as depending on digits.
+def isDigitBlind(regex):
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '\\':
+            if i + 1 < len(regex) and (regex[i + 1].isdigit() or regex[i + 1] in DIGIT_ESCAPES):
+                return False
+            i += 2
+            continue
+        if char.isdigit() or char in '.[':
+            return False
+        i += 1
+    return True
 
 # Returns the string representation of a floating point number num according to standard accounting convention.
 def formatNumber(num):
     return "{:,.2f}".format(num)
 
-# Dumps a dictionary object to a file in the current folder given by filename.
-def saveDictToJson(dictionary, filename):
-    with open(filename, 'w') as file:
-        json.dump(dictionary, file)
+# Dumps a dictionary object to a file in the current folder given by filename. The function default is called
+# for objects that can not otherwise be serialized (see json.dump). The file is written atomically, and a new file
+# gets the permissions given by mode (see writeFileAtomically).
+def saveDictToJson(dictionary, filename, default=None, mode=None):
+    writeFileAtomically(filename, lambda file: json.dump(dictionary, file, default=default), mode)
+    return
+
+# Writes a file by calling write with a temporary file next to filename opened for writing. When write is done, the
+# temporary file is flushed to disk and renamed to filename, which atomically replaces any existing file. An
+# interrupted write therefore leaves the old file as it was instead of a truncated file.
+# The permissions of an existing file are kept. A new file gets the permissions given by mode, e.g. 0o600 for files
+# with secrets, or the default permissions if mode is None. The newline argument is passed on to open, e.g. '' to
+# write the line endings as they are instead of translating them to those of the platform.
+def writeFileAtomically(filename, write, mode=None, newline=None):
+    if os.path.exists(filename):
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    # The name is unique for each thread, since several files may be saved concurrently.
+    temp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        # The temporary file is only readable by the owner until it has the right permissions, so that secrets are
+        # never exposed.
+        with os.fdopen(os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 if mode != None else 0o666), 'w', newline=newline) as file:
+            if mode != None:
+                os.chmod(temp_filename, mode)
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+    syncDirectory(os.path.dirname(os.path.abspath(filename)))
+    return
+
+# Flushes a directory to disk, so that a file renamed into it is still there after a crash. Not possible on Windows,
+# where it is skipped.
+def syncDirectory(path):
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
     return
 
 
@@ -42,3 +166,14 @@ def loadJsonFile(filename):
     raise Exception(f"ERROR: Could not find settings file at: \n{conf_path}")
     return
 
+# Changes a text file in the same folder as the script by replacing its text with what update returns for it. In this
+# program it is used to edit the settings file without changing the formatting of the rest of it.
+def updateTextFile(filename, update):
+    script_folder = os.path.normpath(os.path.dirname(os.path.realpath(__file__)))
+    conf_path = script_folder + "/" + filename
+
+    with open(conf_path, "r") as f:
+        text = f.read()
+    writeFileAtomically(conf_path, lambda f: f.write(update(text)))
+    return
+
@@ -1,16 +1,131 @@
+# Here we collect the functions concerning the exchange rate between NOK and mBTC. The rates are fetched from the
+# CoinGecko API and every observed rate is kept in a history in the file btc_rates.json in the script folder:
+#   - The current rate is only fetched again when the latest observation is older than the setting "btc_rate_ttl"
+#     (seconds, default 3600).
+#   - The rate as of a date in the past, e.g. the end date of a month, is taken from the history if it has been
+#     observed that day, and otherwise fetched once from the historical prices of CoinGecko and added to the history.
+#     Importing an old month again therefore gives the same rate without any network calls.
+#   - If CoinGecko can not be reached, the latest observation before the date is used if it is at most
+#     "btc_rate_max_age" days old (default 7), before falling back to FALLBACK_NOK_MBTC.
+
+from aux_functions import saveDictToJson, eprint
+from http_client import request, checkResponse
+from datetime import datetime, timedelta
+import threading
 import requests
+import bisect
 import json
+import os
+
+API_URL = 'https://api.coingecko.com/api/v3'
+RATE_CACHE_FILENAME = 'btc_rates.json'
+DEFAULT_TTL = 3600
+DEFAULT_MAX_AGE = 7
+# The rate used when no observed rate is recent enough.
+FALLBACK_NOK_MBTC = 300
+
+
+class BTCRateCache:
+    def __init__(self, filename = RATE_CACHE_FILENAME):
+        script_folder = os.path.normpath(os.path.dirname(os.path.realpath(__file__)))
+        self.path = os.path.join(script_folder, filename)
+        # Sorted list of [datetime, nok_mbtc] observations, and the list of their datetimes for searching.
+        self.rates = []
+        self.dates = []
+        # Rates may be looked up and recorded by several threads at once.
+        self.lock = threading.Lock()
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.rates = [[datetime.fromisoformat(date), rate] for date, rate in json.load(f)['rates']]
+            self.rates.sort()
+            self.dates = [date for date, _ in self.rates]
+
+    # Returns the latest observed rate at or before date, if it was observed at most max_age before date. Otherwise
+    # None is returned.
+    def asOf(self, date, max_age):
+        with self.lock:
+            i = bisect.bisect_right(self.dates, date)
+            if i == 0 or date - self.dates[i - 1] > max_age:
+                return None
+            return self.rates[i - 1][1]
+
+    # Adds an observed rate to the history and writes it to the file.
+    def record(self, date, rate):
+        with self.lock:
+            i = bisect.bisect_right(self.dates, date)
+            self.dates.insert(i, date)
+            self.rates.insert(i, [date, rate])
+            saveDictToJson({'rates' : [[date.isoformat(), rate] for date, rate in self.rates]}, self.path)
+        return
+
+# The session shared by the calls to CoinGecko, so that the connection is reused.
+session = requests.Session()
+
+# The history shared by all the calls in a run, loaded the first time it is needed.
+rate_cache = None
+rate_cache_lock = threading.Lock()
+
+def getRateCache():
+    global rate_cache
+    with rate_cache_lock:
+        if rate_cache == None:
+            rate_cache = BTCRateCache()
+        return rate_cache
+
+# Calls the CoinGecko API for the current price of a bitcoin and returns the price of one mBTC in NOK. The timeouts
+# and retries are given by settings_dict (see http_client.py).
+def fetchCurrentNOKPrmBTC(settings_dict = None):
+    call = "CoinGecko price"
+    response_obj = request('coingecko', call, session, 'GET', f'{API_URL}/simple/price', settings_dict,\
+            params={'ids' : 'bitcoin', 'vs_currencies' : 'nok'})
+    return checkResponse(call, response_obj).json()['bitcoin']['nok']/1000
+
+# Calls the CoinGecko API for the price of a bitcoin at the start (00:00 UTC) of the day of date and returns the price
+# of one mBTC in NOK.
+def fetchHistoricalNOKPrmBTC(date, settings_dict = None):
+    call = "CoinGecko history"
+    response_obj = request('coingecko', call, session, 'GET', f'{API_URL}/coins/bitcoin/history', settings_dict,\
+            params={'date' : date.strftime('%d-%m-%Y'), 'localization' : 'false'})
+    return checkResponse(call, response_obj).json()['market_data']['current_price']['nok']/1000
+
+# Find the amount of money in Norwegian Kroner one milli-bitcoin in worth. By default this is the current rate, but if
+# as_of is a date before today, the rate as of that date is returned instead. The rates are cached as described at the
+# top of this file, with the settings taken from settings_dict. Raises an exception if there is no recent enough rate.
+def getNOKPrmBTC(settings_dict = None, as_of = None):
+    settings_dict = settings_dict if settings_dict != None else {}
+    ttl = timedelta(seconds=settings_dict.get('btc_rate_ttl', DEFAULT_TTL))
+    max_age = timedelta(days=settings_dict.get('btc_rate_max_age', DEFAULT_MAX_AGE))
+    cache = getRateCache()
 
-# Find the amount of money in Norwegian Kroner one milli-bitcoin in worth by calling the coingecko API
-def getNOKPrmBTC():
-    # Set up the API endpoint and parameters
-    api_endpoint = 'https://api.coingecko.com/api/v3/simple/price'
-    currency = 'nok'
-    crypto = 'bitcoin'
+    now = datetime.now()
+    past = as_of != None and as_of.date() < now.date()
+    if past:
+        date = datetime(as_of.year, as_of.month, as_of.day)
+        # Observations made during the day are used as well as the historical price at the start of the day.
+        rate = cache.asOf(date + timedelta(days=1), timedelta(days=1))
+    else:
+        date = now
+        rate = cache.asOf(date, ttl)
+    if rate != None:
+        return rate
 
-    # Make the API request and extract the exchange rate
-    response_obj = requests.get(f'{api_endpoint}?ids={crypto}&vs_currencies={currency}')
-    response = response_obj.json()
-    
-    return response[crypto][currency]/1000
+    try:
+        rate = fetchHistoricalNOKPrmBTC(date, settings_dict) if past else fetchCurrentNOKPrmBTC(settings_dict)
+    except Exception as e:
+        rate = cache.asOf(date, max_age)
+        if rate == None:
+            raise e
+        eprint(f"Warning: {e}\nUsing the latest Bitcoin exchange rate before {date.strftime('%d/%m/%Y')}: {rate}")
+        return rate
+    cache.record(date, rate)
+    return rate
 
+# Returns the rate to use when getNOKPrmBTC fails or does not reply in time: the latest rate observed at most
+# "btc_rate_max_age" days before as_of (default now), or FALLBACK_NOK_MBTC if there is none.
+def fallbackNOKPrmBTC(settings_dict = None, as_of = None):
+    settings_dict = settings_dict if settings_dict != None else {}
+    max_age = timedelta(days=settings_dict.get('btc_rate_max_age', DEFAULT_MAX_AGE))
+    date = as_of if as_of != None and as_of < datetime.now() else datetime.now()
+    rate = getRateCache().asOf(date, max_age)
+    return rate if rate != None else FALLBACK_NOK_MBTC
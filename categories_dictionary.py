@@ -6,8 +6,15 @@
 #       { 'in': <num>, 'out' : <num, ..}, { ...  }, ... ] }, '<category name2>' : { 'sum_out' : '<num>', 
 #   ...}, { ... }, ... }
 
-from aux_functions import formatNumber, matchesAnyOne
+from aux_functions import formatNumber, eprint, matchesAnyOne, RegexMatcher, literalFromRegex, isDigitBlind
+from category_cache import cacheKey
+from aho_corasick import AhoCorasick
+from learned_rules import normalizeMerchantText
+from rule_profiler import SKIP_GROUP
+from accounting_data import getMonthKey
 from tabulate import tabulate
+import time
+import sys
 
 
 # This function takes the dictionary associated with a single transaction and prints a nicely formatted string
@@ -16,6 +23,156 @@ def printTransactionLine(transaction_dictionary):
     print(f"{transaction_dictionary['date_book'].strftime('%Y-%m-%d')}\t{formatNumber(transaction_dictionary['out'])}\t{transaction_dictionary['type']}\t{transaction_dictionary['text']}")
 
 
+# ----------------------------------------------------------------------------------
+# Category matching
+# ----------------------------------------------------------------------------------
+
+# Finds the first of a list of groups of regex-patterns with a pattern matching a text. The patterns that only
+# match fixed strings, which are most of the patterns in practice, are searched for with a single Aho-Corasick
+# automaton, so that adding more of them does not make the search slower. The remaining patterns are compiled into
+# one RegexMatcher per group, and are only tried for the groups before the first group with a matching fixed string.
+# Since most texts do not match any of the remaining patterns, a single RegexMatcher of all of them is tried first.
+class PatternGroupMatcher:
+    def __init__(self, regex_groups):
+        self.automaton = AhoCorasick()
+        self.regex_matchers = []
+        all_regexes = []
+        for i, regex_list in enumerate(regex_groups):
+            regexes = []
+            for regex in regex_list:
+                literal = literalFromRegex(regex)
+                if literal != None:
+                    self.automaton.add(literal, i)
+                else:
+                    regexes.append(regex)
+            if len(regexes) > 0:
+                self.regex_matchers.append((i, RegexMatcher(regexes)))
+                all_regexes += regexes
+        self.any_regex_matcher = RegexMatcher(all_regexes)
+        self.automaton.build()
+
+    # Returns the index of the first group with a pattern matching a text which is already in lower case, or None
+    # if there is none.
+    def firstMatchLowered(self, lowered):
+        first_literal = self.automaton.minimumValue(lowered)
+        if len(self.regex_matchers) == 0 or not self.any_regex_matcher.matchesLowered(lowered):
+            return first_literal
+        for i, regex_matcher in self.regex_matchers:
+            if first_literal != None and i >= first_literal:
+                break
+            if regex_matcher.matchesLowered(lowered):
+                return i
+        return first_literal
+
+# Holds the regex-patterns of the categories and skip regexes in settings_dict compiled into PatternGroupMatchers,
+# so that the patterns are only compiled once per run. The categories are tried in the order of the settings and
+# the first category with a matching pattern wins.
+# If a category cache (see category_cache.py) is given, it holds the verdicts of the digit blind patterns (see
+# aux_functions.isDigitBlind), and only the other patterns are matched for texts in the cache. If learned rules
+# (see learned_rules.py) are given, they are used for texts not matching any patterns.
+# If a rule profiler (see rule_profiler.py) is given, every pattern is instead searched for separately through
+# matchesAnyOne, so that the profiler can record each of them. The cache is then not used.
+class CategoryMatcher:
+    def __init__(self, settings_dict, cache=None, learned=None, profiler=None):
+        categories = settings_dict['categories'] # List of dicts containg keys 'name' and 'regexes'
+        self.names = [cat['name'] for cat in categories]
+        self.category_matcher = PatternGroupMatcher([cat['regexes'] for cat in categories])
+        self.skip_matcher = SkipMatcher(settings_dict['skip_regexes'])
+        self.cache = cache if profiler == None else None
+        self.learned = learned
+        self.profiler = profiler
+        self.categories = categories
+        self.skip_regexes = settings_dict['skip_regexes']
+
+        if self.cache != None:
+            self.positions = {name : i for i, name in reversed(list(enumerate(self.names)))}
+            self.blind_matcher = PatternGroupMatcher([[regex for regex in cat['regexes'] if isDigitBlind(regex)] for cat in categories])
+            self.blind_skip_matcher = SkipMatcher([regex for regex in self.skip_regexes if isDigitBlind(regex)])
+            # The patterns depending on digits, or None if there are none.
+            self.digit_matcher = None
+            self.digit_skip_matcher = None
+            digit_regexes = [[regex for regex in cat['regexes'] if not isDigitBlind(regex)] for cat in categories]
+            if any([len(regexes) > 0 for regexes in digit_regexes]):
+                self.digit_matcher = PatternGroupMatcher(digit_regexes)
+            digit_skip_regexes = [regex for regex in self.skip_regexes if not isDigitBlind(regex)]
+            if len(digit_skip_regexes) > 0:
+                self.digit_skip_matcher = SkipMatcher(digit_skip_regexes)
+
+    # Returns the name of the first category matching a text which is already in lower case, or None if there is none.
+    def categorizeLowered(self, lowered):
+        if self.profiler != None:
+            return self.categorizeProfiled(lowered)
+        i = self.category_matcher.firstMatchLowered(lowered)
+        if i == None:
+            return None
+        return self.names[i]
+
+    # Returns the name of the first category matching a text, or None if there is none.
+    def categorize(self, text):
+        return self.categorizeLowered(text.lower())
+
+    # Does the same as categorizeLowered, searching for the patterns one by one while recording them in the profiler.
+    def categorizeProfiled(self, lowered):
+        for cat in self.categories:
+            if matchesAnyOne(cat['regexes'], lowered, self.profiler, cat['name']):
+                return cat['name']
+        return None
+
+    # Returns True if any of the skip regexes matches a text which is already in lower case.
+    def skippedLowered(self, lowered):
+        if self.profiler != None:
+            return matchesAnyOne(self.skip_regexes, lowered, self.profiler, SKIP_GROUP)
+        return self.skip_matcher.matchesLowered(lowered)
+
+    # Returns True if any of the skip regexes matches a text, like RegexMatcher.matches, so that the matcher can be
+    # used for the skip checks of the income as well (see accounting_data.MonthlyTallies).
+    def matches(self, text):
+        return self.skippedLowered(text.lower())
+
+    # Returns a tuple of the name of the first category matching a text which is already in lower case (or None) and
+    # whether the text matches any of the skip regexes. The latter is only determined when no category matches.
+    def classifyLowered(self, lowered):
+        if self.cache != None:
+            category_name, skipped = self.classifyCached(lowered)
+        else:
+            category_name = self.categorizeLowered(lowered)
+            skipped = category_name == None and self.skippedLowered(lowered)
+
+        # The learned rules change between runs, so they are applied after the cache.
+        if category_name == None and (not skipped) and self.learned != None:
+            category_name = self.learned.lookupLowered(lowered, self.names)
+        return category_name, skipped
+
+    # Does the same as classifyLowered without the learned rules, using the category cache. The verdict of the digit
+    # blind patterns is taken from the cache, or cached, and combined with the patterns depending on digits, so that
+    # the result is the same as when matching all the patterns.
+    def classifyCached(self, lowered):
+        key = cacheKey(lowered)
+        entry = self.cache.get(key)
+        if entry == None:
+            i = self.blind_matcher.firstMatchLowered(lowered)
+            entry = (self.names[i] if i != None else None, i == None and self.blind_skip_matcher.matchesLowered(lowered))
+            self.cache.put(key, *entry)
+        category_name, skipped = entry
+
+        if self.digit_matcher != None:
+            i = self.digit_matcher.firstMatchLowered(lowered)
+            if i != None and (category_name == None or i < self.positions[category_name]):
+                return self.names[i], False
+        if category_name == None and (not skipped) and self.digit_skip_matcher != None:
+            skipped = self.digit_skip_matcher.matchesLowered(lowered)
+        return category_name, skipped
+
+# Matches texts against the skip regexes.
+class SkipMatcher:
+    def __init__(self, skip_regexes):
+        self.matcher = PatternGroupMatcher([skip_regexes])
+
+    # Returns True if any of the skip regexes matches a text which is already in lower case.
+    def matchesLowered(self, lowered):
+        return self.matcher.firstMatchLowered(lowered) != None
+
+
 # ----------------------------------------------------------------------------------
 # Creation functions
 # ----------------------------------------------------------------------------------
@@ -35,37 +192,69 @@ def initializeCategories(settings_dict):
 
 # Takes accounting data in the form of a list of dicts and categorizes each element in this list according
 # to the categories defined in settings_dict by using the lists of regex-patterns defined there.
-# It also returns the remaining items that were not automatically categorized as a list.
+# It also returns the remaining items that were not automatically categorized as a list. If a category cache is
+# given, the categories of known texts are looked up in it instead. If learned rules are given, they are used for
+# the transactions that do not match any regex-pattern. If a rule profiler is given, the patterns are recorded in it.
 # TODO: Make this only consider expenses and not income. Calculate total income by directly summing the accounting
 # data without categorizing income data and remove the sum_in for each category.
-# Account data takes the form [ {'date_book', 'date_rent', 'account_to', 'type', 'text', 'out', 'in'}, {...}, ... ]
-def autoCategorizeExpenses(accounting_data, settings_dict):
+# Account data can be any iterable of transactions, e.g. the generator from accounting_data.iterAccountingData, and
+# takes the form [ {'date_book', 'date_rent', 'account_to', 'type', 'text', 'out', 'in'}, {...}, ... ]
+def autoCategorizeExpenses(accounting_data, settings_dict, cache=None, learned=None, profiler=None):
 
     cats_dict = initializeCategories(settings_dict)
-    categories = settings_dict['categories'] # List of dicts containg keys 'name' and 'regexes'
     remainder_list = []
+    matcher = CategoryMatcher(settings_dict, cache, learned, profiler)
 
     # Loop through the accounting data
     for line in accounting_data:
-        # Only attemt to categorize expenses
-        if line['out'] > 0:
-            text = line['text']
+        autoCategorizeLine(line, cats_dict, remainder_list, matcher)
+
+    return cats_dict, remainder_list
 
+# Categorizes a single transaction by putting it in the first category of cats_dict with a matching regex-pattern.
+# If it is an expense not matching any category or skip regex, it is put in the remainder list.
+# The category and skip verdict are tagged on the transaction, and transactions that are already tagged are not
+# matched again.
+def autoCategorizeLine(line, cats_dict, remainder_list, matcher):
+    # Only attemt to categorize expenses
+    if line['out'] > 0:
+        if line.skipped == None:
             # Go through the list of categories to look for a place to put the line
-            found_match = False
-            for cat in categories:
-                if matchesAnyOne(cat['regexes'], text):
-                    # Put the line in the matching category.
-                    cats_dict[cat['name']]['transactions'].append(line)
-                    found_match = True
-                    break
+            line.category, line.skipped = matcher.classifyLowered(line.text.lower())
+        category_name, skipped = line.category, line.skipped
+        if category_name != None:
+            # Put the line in the matching category.
+            cats_dict[category_name]['transactions'].append(line)
+
+        # If the line was not found in any of the categories and we don't want to ignore it (meaning that
+        # it is not found among the regexes in the skip_regexes list), then we save it for later in the remainder list.
+        elif not skipped:
+            remainder_list.append(line)
+    return
+
+# Does the same as autoCategorizeExpenses for accounting data spanning several months, in a single pass through the
+# data. Returns a dictionary with the month of the booking date (see accounting_data.getMonthKey) as keys and
+# (cats_dict, remainder_list) tuples as values. If a CategoryMatcher is given, it is used instead of making one
+# from the other arguments.
+def autoCategorizeExpensesByMonth(accounting_data, settings_dict, cache=None, learned=None, profiler=None, matcher=None):
+    months = {}
+    if matcher == None:
+        matcher = CategoryMatcher(settings_dict, cache, learned, profiler)
+
+    for line in accounting_data:
+        month = getMonthKey(line['date_book'])
+        if month not in months:
+            months[month] = (initializeCategories(settings_dict), [])
+        cats_dict, remainder_list = months[month]
+        autoCategorizeLine(line, cats_dict, remainder_list, matcher)
 
-            # If the line was not found in any of the categories and we don't want to ignore it (meaning that
-            # it is not found among the regexes in the skip_regexes list), then we save it for later in the remainder list.
-            if (not found_match) and (not matchesAnyOne(settings_dict['skip_regexes'], text)):
-                remainder_list.append(line)
+    return months
 
-    return cats_dict, remainder_list
+# Calculates the sum of the expenses in each category and stores it in the category's 'sum_out'.
+def sumCategories(cats_dict):
+    for cat_dict in cats_dict.values():
+        cat_dict['sum_out'] = sum([trans['out'] for trans in cat_dict['transactions']])
+    return
 
 def printCategoryChoiceHelp(options_menu, category_menu):
     print("Please select an option from the choices below.\n")
@@ -77,15 +266,58 @@ def printCategoryChoiceHelp(options_menu, category_menu):
 def validCategoryChoice(choice_str, enumerate_cat_names):
     if choice_str.isdigit() and int(choice_str) >= 0 and int(choice_str) < len(enumerate_cat_names):
         return True
-    elif choice_str in ["a", "s", "e", "p", "h"]:
+    elif choice_str in ["a", "s", "e", "p", "l", "h"]:
         return True
     else:
         return False
 
-# Takes a list of accounting data and asks the user to choose which category to put each transaction in.
-# Other options are as described in the options menu defined in the function.
-def manuallyCategorizeData(cats_dict, accounting_data, settings_dict):
-    remainder_list = []
+# Parses a choice of the form "3,7,9 -> 4", giving several group numbers and what to do with them. Returns a tuple of
+# the list of group numbers and the choice after the arrow, or None if choice_str is not of this form or refers to
+# groups that are not in remaining_groups. A group given more than once is only included once, in its first position.
+def parseGroupChoice(choice_str, remaining_groups):
+    if "->" not in choice_str:
+        return None
+    groups_str, choice = choice_str.split("->", 1)
+    numbers = [number.strip() for number in groups_str.split(",")]
+    if not all([number.isdigit() and int(number) in remaining_groups for number in numbers]):
+        return None
+    return list(dict.fromkeys([int(number) for number in numbers])), choice.strip()
+
+# Groups a list of transactions by their normalized merchant text (see learned_rules.normalizeMerchantText), so that
+# a merchant appearing many times only needs one choice. Returns a list of lists of transactions, sorted by the total
+# amount of each group with the largest first. The transactions of each group keep their order.
+def groupTransactionsByMerchant(accounting_data):
+    groups = {}
+    for line in accounting_data:
+        groups.setdefault(normalizeMerchantText(line['text']), []).append(line)
+    return sorted(groups.values(), key=sumGroup, reverse=True)
+
+# Returns the total amount of a group of transactions, counting both expenses and income.
+def sumGroup(group):
+    return sum([line['out'] + line['in'] for line in group])
+
+# Prints a table of the groups of transactions with the given numbers.
+def printGroupsTable(groups, group_numbers):
+    data = [[i, len(groups[i]), formatNumber(sumGroup(groups[i])), groups[i][0]['text']] for i in group_numbers]
+    headers = ["Group", "Count", "Total", "Comment"]
+    print(tabulate(data, headers=headers, colalign=("right", "right", "right", "left"), disable_numparse=True))
+
+# Prints the first max_lines transactions of a group, which is the one chosen by typing only a number.
+def printCurrentGroup(groups, group_number, max_lines = 5):
+    group = groups[group_number]
+    print(f"Group {group_number}: {len(group)} transaction(s), {formatNumber(sumGroup(group))} NOK in total")
+    for line in group[:max_lines]:
+        printTransactionLine(line)
+    if len(group) > max_lines:
+        print(f"... and {len(group) - max_lines} more")
+
+# Takes a list of accounting data and asks the user to choose which category to put the transactions in. The
+# transactions are grouped by merchant (see groupTransactionsByMerchant) and each choice applies to a whole group,
+# either the current group or the groups listed in a choice like "3,7,9 -> 4".
+# Other options are as described in the options menu defined in the function. If learned rules are given, the
+# choices are recorded in them, unless the user aborts.
+def manuallyCategorizeData(cats_dict, accounting_data, settings_dict, learned=None):
+    choices = []
     # Set the prompt used when asking for user input.
     prompt = settings_dict['prompt']
 
@@ -94,48 +326,75 @@ def manuallyCategorizeData(cats_dict, accounting_data, settings_dict):
     category_menu = '\n'.join(enumerated_cat_names)
 
     # Write help menu
-    options_menu = """  a: Abort. Reset any previous choices and return.
-  s: Skip. Put the transaction in a remainder list and continue to the next one.
-  e: End. Skip the remaining transactions and return current choices.
+    options_menu = """  <groups> -> <category>: Put several groups in a category, e.g. "3,7,9 -> 4". Use 's' as category to skip them.
+  a: Abort. Reset any previous choices and return.
+  s: Skip. Put the current group in a remainder list and continue to the next one.
+  e: End. Skip the remaining groups and return current choices.
   p: Print category choices.
+  l: List the remaining groups.
   h: Print all available choices.
 """
-    
-    # Print categories
-    print("For each transaction, please choose a category from the below list by typing the corresponding number.")
+
+    groups = groupTransactionsByMerchant(accounting_data)
+    # Numbers of the groups not yet categorized or skipped, in the order they are presented.
+    remaining_groups = list(range(len(groups)))
+    categorized_ids = set()
+
+    # Print categories and groups
+    print(f"The {len(accounting_data)} remaining transactions are grouped by merchant into {len(groups)} groups.")
+    print("For each group, please choose a category from the below list by typing the corresponding number.")
     print(category_menu)
+    if len(groups) > 0:
+        printGroupsTable(groups, remaining_groups)
 
     dict_keys = list(cats_dict.keys())
     # Create shallow backup copy of data dictionary
     backup_lists = [cats_dict[key]['transactions'][:] for key in dict_keys]
 
-    # Loop through uncategorized data
-    for i, line in enumerate(accounting_data):
-        printTransactionLine(line)
+    # Loop through the groups, the current group being the first remaining one
+    while len(remaining_groups) > 0:
+        printCurrentGroup(groups, remaining_groups[0])
 
         # Choice loop
-
         while True:
-            choice_str = input(prompt)
-            if not validCategoryChoice(choice_str, enumerated_cat_names):
-                print(f'Invalid choice: \"{choice_str}\".')
+            input_str = input(prompt).strip()
+            choice_str = input_str
+            group_choice = parseGroupChoice(input_str, remaining_groups)
+            if group_choice != None:
+                chosen_groups, choice_str = group_choice
+            else:
+                chosen_groups = [remaining_groups[0]]
+
+            if choice_str.isdigit() and validCategoryChoice(choice_str, enumerated_cat_names):
+                category_name = dict_keys[int(choice_str)]
+                for group_number in chosen_groups:
+                    for line in groups[group_number]:
+                        line.category = category_name
+                        cats_dict[category_name]['transactions'].append(line)
+                        categorized_ids.add(id(line))
+                    # A group is one merchant, so the choice is recorded once however many transactions it has.
+                    choices.append((groups[group_number][0]['text'], category_name))
+                    remaining_groups.remove(group_number)
+            elif choice_str == "s":
+                for group_number in chosen_groups:
+                    remaining_groups.remove(group_number)
+            elif group_choice != None or not validCategoryChoice(choice_str, enumerated_cat_names):
+                print(f'Invalid choice: \"{input_str}\".')
                 printCategoryChoiceHelp(options_menu, category_menu)
                 continue
-            elif choice_str.isdigit():
-                choice = int(choice_str)
-                cats_dict[dict_keys[choice]]['transactions'].append(line)
             elif choice_str == "a":
                 # Reset all transaction lists to backups
                 for i, key in enumerate(dict_keys):
                     cats_dict[key]['transactions'] = backup_lists[i]
-                return
-            elif choice_str == "s":
-                remainder_list.append(line)
+                return accounting_data[:]
             elif choice_str == "e":
-                return remainder_list + accounting_data[i:]
+                remaining_groups = []
             elif choice_str == "p":
                 print(category_menu)
                 continue
+            elif choice_str == "l":
+                printGroupsTable(groups, remaining_groups)
+                continue
             elif choice_str == "h":
                 printCategoryChoiceHelp(options_menu, category_menu)
                 continue
@@ -144,7 +403,37 @@ def manuallyCategorizeData(cats_dict, accounting_data, settings_dict):
                 exit(-1)
             break
 
-    return remainder_list # After for-loop
+    recordChoices(learned, choices)
+    # The skipped transactions are returned in their original order.
+    return [line for line in accounting_data if id(line) not in categorized_ids]
+
+# Returns True if the program should run without asking the user for anything, e.g. in a scheduled job. This is
+# set by the setting "headless" or the --headless command-line argument.
+def isHeadless(settings_dict):
+    return settings_dict.get('headless', False)
+
+# Used instead of manuallyCategorizeData when running headless. If the setting "fallback_category" names a category,
+# all the transactions in accounting_data are put in it. Otherwise nothing is categorized. Returns the list of
+# transactions that are still uncategorized.
+def resolveUncategorizedData(cats_dict, accounting_data, settings_dict):
+    fallback_category = settings_dict.get('fallback_category')
+    if fallback_category == None:
+        return accounting_data[:]
+    if fallback_category not in cats_dict:
+        eprint(f"Warning: The fallback category {fallback_category} does not exist.")
+        return accounting_data[:]
+
+    for line in accounting_data:
+        line.category = fallback_category
+    cats_dict[fallback_category]['transactions'].extend(accounting_data)
+    return []
+
+# Records a list of (text, category name) choices in the learned rules, if they are given.
+def recordChoices(learned, choices):
+    if learned != None:
+        for text, category_name in choices:
+            learned.record(text, category_name)
+    return
 
 # Takes a processed list of transactions and categorizes these transactions in cateogies defined in
 # the settings_dict dictionary object.
@@ -201,10 +490,14 @@ def printExpensesTable(trans_list):
 # Takes the list of category transactions, sums the categories that are relevant for 
 # consumption commitments and then among the transactions in those categories asks whether
 # any specific transactions should be excluded from the sum (i.e. subtracted).
+# When running headless the user is not asked. Instead the transactions matching any of the regexes in the setting
+# "consumption_commitment_exclude_regexes" are excluded.
 def determineConsumptionCommitments(cats_dict, settings_dict):
     cons_commits = 0.0
     prompt = settings_dict['prompt']
     cons_commit_cats = settings_dict['consumption_commitment_categories']
+    headless = isHeadless(settings_dict)
+    exclude_matcher = RegexMatcher(settings_dict.get('consumption_commitment_exclude_regexes', []))
 
     # Loop through consumption commitment categories
     for category_name in cons_commit_cats:
@@ -214,7 +507,10 @@ def determineConsumptionCommitments(cats_dict, settings_dict):
         included_transactions = cat_dict['transactions'][:]
 
 
-        if len(included_transactions) > 0:
+        if headless:
+            excluded_transactions = [transaction for transaction in included_transactions if exclude_matcher.matches(transaction['text'])]
+            included_transactions = [transaction for transaction in included_transactions if not exclude_matcher.matches(transaction['text'])]
+        elif len(included_transactions) > 0:
             # Get user input on which transactions should be subtracted
             print("Choose the numbers of any transactions below that should not be counted as consumption commitments.")
             print("Press 'x' to confirm current choices")
@@ -243,3 +539,88 @@ def determineConsumptionCommitments(cats_dict, settings_dict):
     return cons_commits
 
 
+
+# ----------------------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------------------
+
+# Generates a settings dictionary with n_categories categories of n_patterns regex-patterns each. Every tenth
+# pattern is a real regex, the rest are plain merchant names.
+def generateSettings(n_categories, n_patterns):
+    categories = []
+    for i in range(n_categories):
+        regexes = []
+        for j in range(n_patterns):
+            if j % 10 == 0:
+                regexes.append(f"merchant{i}x{j}\\s+(avd|butikk) \\d+")
+            else:
+                regexes.append(f"merchant{i}x{j}")
+        categories.append({'name' : f'category{i}', 'regexes' : regexes})
+    return {'categories' : categories, 'skip_regexes' : ['nettbank til:', 'overføring']}
+
+# Generates n_rows synthetic transaction texts, where one in four does not match any category.
+def generateTexts(n_rows, n_categories, n_patterns):
+    texts = []
+    for i in range(n_rows):
+        if i % 4 == 0:
+            texts.append(f"*4481 09.02 NOK 189.00 UKJENT BUTIKK {i} Kurs: 1.0000")
+        else:
+            texts.append(f"*4481 09.02 NOK 189.00 MERCHANT{i % n_categories}X{(i * 7) % n_patterns} AVD {i % 100} Kurs: 1.0000")
+    return texts
+
+# Categorizes a text the way it was done before the CategoryMatcher, by searching for every pattern separately.
+def categorizeTextReference(text, settings_dict):
+    for cat in settings_dict['categories']:
+        if matchesAnyOne(cat['regexes'], text):
+            return cat['name']
+    return None
+
+# Categorizes a text using only one compiled RegexMatcher per category, without the Aho-Corasick automaton.
+def categorizeTextCompiled(text, regex_matchers):
+    lowered = text.lower()
+    for name, regex_matcher in regex_matchers:
+        if regex_matcher.matchesLowered(lowered):
+            return name
+    return None
+
+# Times the categorization of synthetic transactions with a large synthetic rule set, searching for each pattern
+# separately compared to one compiled regex per category and the CategoryMatcher, and checks that they all give
+# the same categories.
+def benchmarkCategorization(n_rows = 5000, n_categories = 40, n_patterns = 10):
+    settings_dict = generateSettings(n_categories, n_patterns)
+    texts = generateTexts(n_rows, n_categories, n_patterns)
+
+    start = time.perf_counter()
+    reference = [categorizeTextReference(text, settings_dict) for text in texts]
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    regex_matchers = [(cat['name'], RegexMatcher(cat['regexes'])) for cat in settings_dict['categories']]
+    compiled = [categorizeTextCompiled(text, regex_matchers) for text in texts]
+    compiled_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = CategoryMatcher(settings_dict)
+    matched = [matcher.categorize(text) for text in texts]
+    matcher_time = time.perf_counter() - start
+
+    if reference != matched or reference != compiled:
+        raise Exception("ERROR: The matchers disagree on the categories")
+
+    headers = ["Matcher", "Time [s]", "Rows / s"]
+    data = [["re.search per pattern", round(reference_time, 3), round(n_rows / reference_time)],\
+            ["compiled alternation per category", round(compiled_time, 3), round(n_rows / compiled_time)],\
+            ["CategoryMatcher", round(matcher_time, 3), round(n_rows / matcher_time)]]
+    print(f"Categorizing {n_rows} rows with {n_categories} categories of {n_patterns} patterns each:")
+    print(tabulate(data, headers=headers, disable_numparse=True, tablefmt="rst"))
+    print(f"Speedup: {round(reference_time / matcher_time, 1)}x")
+    return
+
+# Running this file runs the benchmark. Optional arguments give the number of rows, categories and patterns
+# per category.
+def main(argv):
+    benchmarkCategorization(*[int(arg) for arg in argv])
+    return
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
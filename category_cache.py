@@ -0,0 +1,85 @@
+# Here we collect the functions concerning the category cache, which remembers the category of transaction texts
+# that have been categorized before. The same merchants appear every month, and looking up the text in the cache
+# is much faster than matching it against all the regex-patterns of the categories.
+#
+# The cache maps the lower case transaction text with every number replaced by 0 (see cacheKey) to the name of the
+# category matched by the digit blind patterns (see aux_functions.isDigitBlind), or None, and whether the text matches
+# any of the digit blind skip regexes. Card transactions contain e.g. the card number, date and amount, so this key
+# is the same for a merchant every month, while the patterns depending on digits are always matched against the text
+# itself (see categories_dictionary.CategoryMatcher). The cache is stored in a json file in the script folder together
+# with a hash of the categories and skip regexes in the settings. If the settings change, the hash no longer matches
+# and the cache is discarded. When the cache holds more than max_size keys, the least recently used ones are removed.
+
+from aux_functions import saveDictToJson
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+
+DEFAULT_CACHE_SIZE = 10000
+# Changed when the meaning of the entries changes, so that older cache files are discarded.
+CACHE_FORMAT = 2
+DIGITS = re.compile(r'\d+')
+
+class CategoryCache:
+    def __init__(self, settings_dict, filename = 'category_cache.json'):
+        script_folder = os.path.normpath(os.path.dirname(os.path.realpath(__file__)))
+        self.path = os.path.join(script_folder, filename)
+        self.max_size = settings_dict.get('category_cache_size', DEFAULT_CACHE_SIZE)
+        self.rules_hash = rulesHash(settings_dict)
+        # Maps lower case texts to (category name, skipped) tuples, ordered from least to most recently used.
+        self.entries = OrderedDict()
+        # The entries that have been looked up or added since the cache was loaded, in the order they were used.
+        self.used = OrderedDict()
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                cache_dict = json.load(f)
+            if cache_dict['rules_hash'] == self.rules_hash:
+                self.entries = OrderedDict([(text, (category, skipped)) for text, category, skipped in cache_dict['entries']])
+
+    # Returns the cached (category name, skipped) tuple of a key (see cacheKey), or None if the key is not cached.
+    def get(self, lowered):
+        entry = self.entries.get(lowered)
+        if entry != None:
+            self.entries.move_to_end(lowered)
+            self.used[lowered] = entry
+            self.used.move_to_end(lowered)
+        return entry
+
+    # Stores the category name and skip status of a key.
+    def put(self, lowered, category_name, skipped):
+        self.entries[lowered] = (category_name, skipped)
+        self.entries.move_to_end(lowered)
+        self.used[lowered] = (category_name, skipped)
+        self.used.move_to_end(lowered)
+        self.evict()
+        return
+
+    # Adds the entries used by a copy of the cache, e.g. one used in another process.
+    def merge(self, used):
+        for lowered, (category_name, skipped) in used.items():
+            self.put(lowered, category_name, skipped)
+        return
+
+    # Removes the least recently used entries until the cache is within its size limit.
+    def evict(self):
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return
+
+    # Writes the cache to its json file.
+    def save(self):
+        entries = [[text, category, skipped] for text, (category, skipped) in self.entries.items()]
+        saveDictToJson({'rules_hash' : self.rules_hash, 'entries' : entries}, self.path)
+        return
+
+# Returns a hash of the categories and skip regexes in the settings, which determine the categories of the texts.
+def rulesHash(settings_dict):
+    rules = {'categories' : settings_dict['categories'], 'skip_regexes' : settings_dict['skip_regexes'], 'format' : CACHE_FORMAT}
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+
+# Returns the key of a lower case text in the cache, where every number is replaced by 0.
+def cacheKey(lowered):
+    return DIGITS.sub('0', lowered)
@@ -11,6 +11,8 @@ from cryptography.fernet import Fernet
 from aux_functions import saveDictToJson, eprint, loadJsonFile
 
 FERNET_KEY_LENGTH = 32
+# Environment variable holding the password of the encrypted credentials when running headless.
+PASSWORD_ENVIRONMENT_VARIABLE = "ACCOUNTING_PASSWORD"
 
 # This outputs the hash as a bytes object with len = hash_len. We assume password is a string, while salt is a
 # bytes object.
@@ -294,7 +296,7 @@ def encryptCredentialsToFile(credz, output_fn = 'api_credentials.json'):
     final_dictionary = {'parameters' : parameters.makeDict(), 'credentials' : [cred.makeDict() for cred in credz]}
 
     # Write this dictionary to file
-    saveDictToJson(final_dictionary, path)
+    saveDictToJson(final_dictionary, path, mode=0o600)
     print("Credentials successfully encrypted. You can now delete the cleartext copy.")
     return output_fn
 
@@ -317,7 +319,9 @@ def combineCredentials(source_list, import_list):
 # credentials are stored. First loads the cleartext credentials if they exist, then attempts to
 # decrypt any encrypted credentials in the output_fn. Exits if no credentials are found. Finally
 # adds all credentials together in a list of dictionaries and outputs this.
-def loadCredentials(folder_name = 'credentials', output_fn = 'api_credentials.json'):
+# If headless is True, the password is not asked for. It is instead read from the environment variable
+# ACCOUNTING_PASSWORD, and the encrypted credentials are skipped if it is not set or is wrong.
+def loadCredentials(folder_name = 'credentials', output_fn = 'api_credentials.json', headless = False):
     
     # Load cleartext credentials.
     try:
@@ -337,7 +341,18 @@ def loadCredentials(folder_name = 'credentials', output_fn = 'api_credentials.js
                                      params_dict['memory_cost'], parallelism = params_dict['parallelism'])
     
     # Decrypt encrypted data
-    while True:
+    if headless:
+        password = os.environ.get(PASSWORD_ENVIRONMENT_VARIABLE)
+        if password == None:
+            eprint(f"Warning: {PASSWORD_ENVIRONMENT_VARIABLE} is not set. Skipping the encrypted credentials.")
+            return cleartext_credz
+        try:
+            decryptCredentialList(password, enc_credz, parameters)
+        except Exception:
+            eprint(f"Warning: Could not decrypt the credentials with the password in {PASSWORD_ENVIRONMENT_VARIABLE}. Skipping them.")
+            return cleartext_credz
+
+    while not headless:
         password = getpass.getpass("Enter password for decrypting credentials: ")
         try:
             decryptCredentialList(password, enc_credz, parameters)
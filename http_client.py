@@ -0,0 +1,138 @@
+# Here we collect the functions shared by all the calls to external APIs (Sbanken and CoinGecko). Every call
+#   - has a connect and a read timeout, so a stalled endpoint can not hang the program,
+#   - is retried a bounded number of times with exponential backoff after connection errors, timeouts and replies
+#     telling that the server is busy or failing (429 and 5xx),
+#   - goes through a circuit breaker for its API, which fails fast without calling the API once a number of calls in
+#     a row have failed, until reset_timeout seconds have passed.
+# When a call fails, a RequestFailed exception tells which call failed, how long was spent on it and why.
+#
+# The limits can be changed with the optional settings "http_connect_timeout", "http_read_timeout" (seconds),
+# "http_retries", "http_failure_threshold" and "http_reset_timeout" (seconds).
+
+import threading
+import requests
+import random
+import time
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+RETRIES = 2
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 60
+# Replies that are worth retrying, since the server may succeed later.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RequestFailed(Exception):
+    def __init__(self, call, elapsed, reason, attempts = 1):
+        self.call = call
+        self.elapsed = elapsed
+        self.reason = reason
+        self.attempts = attempts
+        super().__init__(str(self))
+
+    def __str__(self):
+        return f"{self.call} failed after {self.elapsed:.2f} s and {self.attempts} attempts: {self.reason}"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold = FAILURE_THRESHOLD, reset_timeout = RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # The number of failed attempts in a row, and the time the breaker opened (None while it is closed).
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    # Returns True if a call may be made. Once reset_timeout has passed after the breaker opened, calls are let
+    # through again, and the breaker closes at the first success.
+    def allow(self):
+        with self.lock:
+            return self.opened_at == None or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def recordSuccess(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+        return
+
+    def recordFailure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+        return
+
+# One circuit breaker for each API, shared by all the threads.
+breakers = {}
+breakers_lock = threading.Lock()
+
+# Returns the circuit breaker of an API, e.g. "sbanken", created with the limits in settings_dict the first time.
+def getBreaker(api, settings_dict = None):
+    settings_dict = settings_dict if settings_dict != None else {}
+    with breakers_lock:
+        if api not in breakers:
+            breakers[api] = CircuitBreaker(api, settings_dict.get('http_failure_threshold', FAILURE_THRESHOLD),\
+                    settings_dict.get('http_reset_timeout', RESET_TIMEOUT))
+        return breakers[api]
+
+# Returns the (connect, read) timeouts in seconds given by settings_dict.
+def getTimeouts(settings_dict = None):
+    settings_dict = settings_dict if settings_dict != None else {}
+    return (settings_dict.get('http_connect_timeout', CONNECT_TIMEOUT), settings_dict.get('http_read_timeout', READ_TIMEOUT))
+
+# Returns the number of seconds to wait before the retry after the given attempt (0 for the first one). A numeric
+# Retry-After header of a response is respected, up to BACKOFF_MAX.
+def backoffDelay(attempt, response = None):
+    if response != None and response.headers.get('Retry-After', '').isdigit():
+        return min(int(response.headers['Retry-After']), BACKOFF_MAX)
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1)
+
+# Calls function, which makes one attempt at the call named call to the API api, with the retries and circuit breaker
+# described at the top of this file. Returns what function returns. If it is a requests.Response with another status
+# than RETRY_STATUSES it is returned, also if it is an error, so that the caller can handle it (see checkResponse).
+# Raises RequestFailed if no attempt succeeded, function raised another exception than a connection error or timeout,
+# or the circuit breaker is open.
+def callWithRetries(api, call, function, settings_dict = None):
+    settings_dict = settings_dict if settings_dict != None else {}
+    retries = settings_dict.get('http_retries', RETRIES)
+    breaker = getBreaker(api, settings_dict)
+    start = time.monotonic()
+
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            raise RequestFailed(call, time.monotonic() - start, f"{api} is unavailable after {breaker.failures} failures in a row",\
+                    attempt)
+        response = None
+        try:
+            response = function()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            reason = f"{type(e).__name__}: {e}"
+        except Exception as e:
+            breaker.recordFailure()
+            raise RequestFailed(call, time.monotonic() - start, f"{type(e).__name__}: {e}", attempt + 1) from e
+        else:
+            if not isinstance(response, requests.Response) or response.status_code not in RETRY_STATUSES:
+                breaker.recordSuccess()
+                return response
+            reason = f"HTTP {response.status_code} {response.reason}"
+        breaker.recordFailure()
+        if attempt < retries:
+            time.sleep(backoffDelay(attempt, response))
+
+    raise RequestFailed(call, time.monotonic() - start, reason, retries + 1)
+
+# Sends a request with a requests.Session (or the requests module) with the timeouts in settings_dict, retrying it
+# as in callWithRetries. Returns the requests.Response.
+def request(api, call, session, method, url, settings_dict = None, **kwargs):
+    timeout = getTimeouts(settings_dict)
+    return callWithRetries(api, call, lambda: session.request(method, url, timeout=timeout, **kwargs), settings_dict)
+
+# Raises RequestFailed if the response of the call named call is an error. Otherwise the response is returned.
+def checkResponse(call, response):
+    if not response.ok:
+        raise RequestFailed(call, response.elapsed.total_seconds(), f"HTTP {response.status_code} {response.reason}")
+    return response
@@ -0,0 +1,149 @@
+# Here we collect the functions concerning learned rules. Every time the user manually puts the transactions of a
+# merchant in a category, the choice is recorded here once, so that transactions with the same merchant can be
+# categorized automatically in later runs instead of asking the user again.
+#
+# The rules map normalized transaction texts (see normalizeMerchantText) to the number of times the user has chosen
+# each category for them, and are stored in a json file in the script folder. The learned rules are only used for
+# transactions that do not match any of the regexes in the settings. Rules that have been learned often enough can be
+# promoted to regexes in the settings file with promoteLearnedRules and insertPromotedRegexes.
+
+from aux_functions import saveDictToJson, eprint
+import json
+import os
+import re
+
+# Used to find where the values of the settings file are in its text.
+json_decoder = json.JSONDecoder()
+WHITESPACE = re.compile(r'\s*')
+
+
+class LearnedRules:
+    def __init__(self, filename = 'learned_rules.json'):
+        script_folder = os.path.normpath(os.path.dirname(os.path.realpath(__file__)))
+        self.path = os.path.join(script_folder, filename)
+        # Dictionary of normalized texts with dictionaries of category names and counts as values.
+        self.rules = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.rules = json.load(f)['rules']
+
+    # Records that the user chose the category category_name for the transactions with a text.
+    def record(self, text, category_name):
+        counts = self.rules.setdefault(normalizeMerchantText(text), {})
+        counts[category_name] = counts.get(category_name, 0) + 1
+        return
+
+    # Returns the category most often chosen for a text which is already in lower case, or None if there is none
+    # or it is not among the category names given.
+    def lookupLowered(self, lowered, category_names):
+        counts = self.rules.get(normalizeLoweredText(lowered))
+        if counts == None:
+            return None
+        category_name = bestCategory(counts)
+        if category_name not in category_names:
+            return None
+        return category_name
+
+    # Writes the learned rules to their json file.
+    def save(self):
+        saveDictToJson({'rules' : self.rules}, self.path)
+        return
+
+# Normalizes a transaction text so that texts from the same merchant become equal. The text is put in lower case,
+# every number is replaced by a single 0 (removing e.g. dates and card numbers) and whitespace is collapsed.
+def normalizeMerchantText(text):
+    return normalizeLoweredText(text.lower())
+
+# Does the same as normalizeMerchantText for a text which is already in lower case.
+def normalizeLoweredText(lowered):
+    return ' '.join(re.sub(r'\d+', '0', lowered).split())
+
+# Returns the category with the highest count in a dictionary of category names and counts.
+def bestCategory(counts):
+    return max(counts, key=counts.get)
+
+# Creates a regex-pattern from a normalized text, which matches all the texts normalized to it.
+def regexFromNormalizedText(normalized):
+    words = []
+    for word in normalized.split(' '):
+        words.append(r'\d+'.join([re.escape(part) for part in word.split('0')]))
+    return r'\s+'.join(words)
+
+# Adds the learned rules where the most chosen category has been chosen at least min_count times to the regexes of
+# this category in the settings. The promoted rules are removed from the learned rules. Returns a list of the
+# promoted (regex, category name) tuples.
+def promoteLearnedRules(learned, settings_dict, min_count = 2):
+    categories = {cat['name'] : cat for cat in settings_dict['categories']}
+    promoted = []
+
+    for normalized, counts in list(learned.rules.items()):
+        category_name = bestCategory(counts)
+        if counts[category_name] < min_count:
+            continue
+        if category_name not in categories:
+            eprint(f"Warning: Category {category_name} learned for '{normalized}' is not in the settings.")
+            continue
+
+        regex = regexFromNormalizedText(normalized)
+        if regex not in categories[category_name]['regexes']:
+            categories[category_name]['regexes'].append(regex)
+            promoted.append((regex, category_name))
+        del learned.rules[normalized]
+
+    return promoted
+
+# Returns the index of the first character after any whitespace from index i of text.
+def skipWhitespace(text, i):
+    return WHITESPACE.match(text, i).end()
+
+# Returns a dictionary of the keys of the JSON object starting at index i of text, with the (start, end) indices of
+# their values in text as values.
+def objectValueSpans(text, i):
+    spans = {}
+    i = skipWhitespace(text, i + 1)
+    while text[i] != '}':
+        key, i = json_decoder.raw_decode(text, i)
+        # Skip the colon.
+        i = skipWhitespace(text, skipWhitespace(text, i) + 1)
+        _, end = json_decoder.raw_decode(text, i)
+        spans[key] = (i, end)
+        i = skipWhitespace(text, end)
+        if text[i] == ',':
+            i = skipWhitespace(text, i + 1)
+    return spans
+
+# Returns a list of the (start, end) indices in text of the elements of the JSON array starting at index i of text.
+def arrayElementSpans(text, i):
+    spans = []
+    i = skipWhitespace(text, i + 1)
+    while text[i] != ']':
+        _, end = json_decoder.raw_decode(text, i)
+        spans.append((i, end))
+        i = skipWhitespace(text, end)
+        if text[i] == ',':
+            i = skipWhitespace(text, i + 1)
+    return spans
+
+# Returns the text of a settings file with the promoted (regex, category name) tuples from promoteLearnedRules added
+# at the end of the regexes of their categories. The rest of the text is left as it was, so that the formatting of
+# the settings file is kept.
+def insertPromotedRegexes(text, promoted):
+    insertions = []
+    categories_start, _ = objectValueSpans(text, skipWhitespace(text, 0))['categories']
+    for category_start, _ in arrayElementSpans(text, categories_start):
+        spans = objectValueSpans(text, category_start)
+        category_name = json.loads(text[spans['name'][0]:spans['name'][1]])
+        regexes = [json.dumps(regex, ensure_ascii=False) for regex, name in promoted if name == category_name]
+        if len(regexes) == 0:
+            continue
+        regexes_start, _ = spans['regexes']
+        elements = arrayElementSpans(text, regexes_start)
+        if len(elements) == 0:
+            insertions.append((regexes_start + 1, ', '.join(regexes)))
+        else:
+            insertions.append((elements[-1][1], ', ' + ', '.join(regexes)))
+
+    # Insert from the end, so that the indices of the other insertions stay the same.
+    for i, insertion in sorted(insertions, reverse=True):
+        text = text[:i] + insertion + text[i:]
+    return text
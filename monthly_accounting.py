@@ -1,36 +1,245 @@
 import sys
 import os
+import glob
 import argparse
-
-from aux_functions import eprint, loadJsonFile
-from results_dictionary import getSaveFileName, importOldResults, addResults, saveResults, printResults, exportResults, calculateResults, printHelp
-from accounting_data import printIncome, importAndValidateCSV
-from categories_dictionary import categorizeExpenses
-
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from aux_functions import eprint, loadJsonFile, updateTextFile, saveDictToJson
+from results_dictionary import getSaveFileName, importOldResults, mergeResults, mergeCategories, saveResults, printResults, exportResults, calculateResults, prefetchBalances, printHelp, serializeResultObject, getResultsStore, resultsExist, loadResultsIndex, loadCategoryTransactions
+from results_index import updateResultsIndex, printReport
+from results_database import ResultsDatabase
+from accounting_data import printIncome, importAndValidateCSV, streamAndValidateTransactions, iterAccountingData
+from categories_dictionary import autoCategorizeExpensesByMonth, CategoryMatcher, manuallyCategorizeData, determineConsumptionCommitments, sumCategories, isHeadless, resolveUncategorizedData
+
+from transaction_index import TransactionIndex
+from category_cache import CategoryCache
+from learned_rules import LearnedRules, promoteLearnedRules, insertPromotedRegexes
+from recategorize import expandResultsPaths, recategorizeResultsFiles
+from rule_profiler import RuleProfiler
 from credential_protection import loadCredentials, encryptCredentialsToFile
+from sbanken_api import getClient
+from sbanken_sync import SyncState, fetchNewTransactions
+
+# Streams transactions from a source, e.g. a CSV file or an account in the Sbanken API, through the
+# auto-categorization and splits them into months in the same pass. Returns the name of the source together with a dictionary with the months as keys and
+# (cats_dict, uncategorized transactions, tally) tuples as values, where the uncategorized transactions are the
+# ones that could not be categorized automatically. If a transaction index is given, transactions that are already
+# in the index are left out, and the fingerprints of the new transactions are returned as well. If a category cache
+# is given, it is used for the categorization and the cache entries used are returned as well. Learned rules are
+# used for the transactions not matching any regex if they are given. Does not ask the user for anything, so that it
+# can run in a separate process. Raises an exception if the source contains invalid data. If a rule profiler is
+# given, its statistics are returned as well.
+def autoCategorizeTransactions(source, transactions, settings_dict, index=None, cache=None, learned=None, profiler=None):
+
+    # The transactions are streamed directly into the auto-categorization, while the tallies keep track of income
+    # and dates. The tallies use the same matcher for the skip regexes, so that the income is profiled as well.
+    matcher = CategoryMatcher(settings_dict, cache, learned, profiler)
+    tallies, accounting_data = streamAndValidateTransactions(transactions, settings_dict, index=index, skip_matcher=matcher)
+    months = autoCategorizeExpensesByMonth(accounting_data, settings_dict, matcher=matcher)
+    if not tallies.isValid():
+        raise Exception(f"Invalid accounting data contained in {source}")
+
+    new_fingerprints = index.new_fingerprints if index != None else set()
+    cache_used = cache.used if cache != None else {}
+    profile_stats = profiler.stats if profiler != None else {}
+    return source, {month : (cats_dict, uncat_acc_data, tallies.tallies[month])\
+            for month, (cats_dict, uncat_acc_data) in months.items()}, new_fingerprints, cache_used, profile_stats
+
+# Does the same as autoCategorizeTransactions for the transactions in a CSV file, which are read one line at a time.
+# Raises an exception if the file could not be imported as well.
+def autoCategorizeCSVFile(import_path, settings_dict, index=None, cache=None, learned=None, profiler=None):
+    return autoCategorizeTransactions(import_path, iterAccountingData(import_path), settings_dict, index, cache, learned, profiler)
+
+# Gets the transactions since the last sync from all the accounts in the Sbanken API (see sbanken_sync.py) and
+# auto-categorizes the transactions of each account as they arrive. The high-water marks in the sync state are moved
+# forward, but not saved. Returns a list of (account name, months) tuples like autoCategorizeCSVFiles.
+def autoCategorizeSyncedTransactions(credentials, settings_dict, state, index=None, cache=None, learned=None, profiler=None):
+    client = getClient(credentials, settings_dict)
+    account_results = []
+    for name, transactions in fetchNewTransactions(client, state, settings_dict):
+        name, months = autoCategorizeTransactions(name, transactions, settings_dict, index, cache, learned, profiler)[:2]
+        print(f"Synced {sum([tally.count for _, _, tally in months.values()])} new transactions from {name}")
+        account_results.append((name, months))
+    return account_results
+
+# Auto-categorizes the CSV files in import_paths. If there are several files, they are processed in parallel in
+# a pool of processes. Files that fail to import are reported and left out. Returns a list of the
+# (path, months) results of autoCategorizeCSVFile in the same order as import_paths.
+#
+# If a transaction index is given, only transactions that are not in the index are imported, and the new
+# transactions are added to it. Since each process only knows about the transactions in the index when the import
+# started, a file overlapping an earlier file in the same import is imported again afterwards, now leaving out
+# the transactions of the earlier files. Similarly, the entries of the category cache used by the processes and the
+# statistics of the rule profiler are added afterwards.
+def autoCategorizeCSVFiles(import_paths, settings_dict, index=None, cache=None, learned=None, profiler=None):
+    if len(import_paths) == 1:
+        try:
+            return [autoCategorizeCSVFile(import_paths[0], settings_dict, index, cache, learned, profiler)[:2]]
+        except Exception as e:
+            eprint(e)
+            eprint(f"ERROR importing file {import_paths[0]}")
+            return []
+
+    file_results = []
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(autoCategorizeCSVFile, path, settings_dict, index, cache, learned, profiler) for path in import_paths]
+        for path, future in zip(import_paths, futures):
+            try:
+                path, months, new_fingerprints, cache_used, profile_stats = future.result()
+                if cache != None:
+                    cache.merge(cache_used)
+                if index != None and index.countKnown(new_fingerprints) > 0:
+                    print(f"{path} overlaps with an earlier file. Importing it again without the overlapping transactions.")
+                    # The statistics of the discarded run are left out, since the new run adds to the profiler itself.
+                    path, months, _, _, _ = autoCategorizeCSVFile(path, settings_dict, index, cache, learned, profiler)
+                else:
+                    if index != None:
+                        index.merge(new_fingerprints)
+                    if profiler != None:
+                        profiler.merge(profile_stats)
+                file_results.append((path, months))
+            except Exception as e:
+                eprint(e)
+                eprint(f"ERROR importing file {path}")
+    return file_results
+
+# Takes a list of results from autoCategorizeCSVFile and combines the results of all files for each month.
+# Returns a dictionary with the months as keys and lists of
+# [paths, cats_dict, uncategorized transactions, tally] as values.
+def groupFileResultsByMonth(file_results):
+    months = {}
+    for path, file_months in file_results:
+        for month, (cats_dict, uncat_acc_data, tally) in file_months.items():
+            if month not in months:
+                months[month] = [[path], cats_dict, uncat_acc_data, tally]
+            else:
+                group = months[month]
+                group[0].append(path)
+                mergeCategories(group[1], cats_dict)
+                group[2] += uncat_acc_data
+                group[3].merge(tally)
+    return months
+
+# Takes the paths to CSV files and processes the transactions contained in them into one results dictionary
+# per month. The files are first parsed and auto-categorized in parallel. Afterwards the results are processed with
+# importResultsFromCategorized.
+def importResultsFromCSVFiles(import_paths, settings_dict, credentials, index=None, cache=None, learned=None, profiler=None, save_path=None):
+    file_results = autoCategorizeCSVFiles(import_paths, settings_dict, index, cache, learned, profiler)
+    return importResultsFromCategorized(file_results, settings_dict, credentials, learned, save_path)
+
+# Takes a list of auto-categorized results from autoCategorizeCSVFiles or autoCategorizeSyncedTransactions and
+# processes them into one results dictionary per month. The user is asked to categorize the remaining transactions
+# and determine the consumption commitments, one month at a time. The choices of the user are recorded in the learned
+# rules, if they are given. Finally the results of all the months are calculated concurrently. Returns a list of
+# (results_dict, tally) tuples sorted by month.
+# When running headless (see categories_dictionary.isHeadless) the user is not asked for anything. The remaining
+# transactions are then put in the fallback category, or written to the pending review file if there is none. The
+# transactions the user skips or leaves when categorizing manually are written to the pending review file as well,
+# since they are already in the transaction index and would otherwise be lost.
+# If a save path is given, the transactions must all be from one month, which is checked before asking the user
+# anything. If review is True, the transactions are the ones from the pending review file, and the pending review
+# file is replaced by the transactions the user skips again.
+def importResultsFromCategorized(file_results, settings_dict, credentials, learned=None, save_path=None, review=False):
+
+    months = groupFileResultsByMonth(file_results)
+    if save_path != '' and save_path != None and len(months) > 1:
+        eprint(f"ERROR: The imported transactions span {len(months)} months and can not be saved to the single file {save_path}")
+        exit(-1)
+    # Get the balance and the exchange rates as of the end of each month while the user categorizes the transactions.
+    prefetched = prefetchBalances(credentials, settings_dict, [months[month][3].end_date for month in months])
+
+    sorted_months = sorted(months)
+    cons_commits = []
+    pending_list = []
+    for month in sorted_months:
+        paths, cats_dict, uncat_acc_data, tally = months[month]
+        print(f"\nProcessing transactions from {month} in {', '.join(paths)}")
+
+        # Manually categorize remaining expense transactions.
+        if isHeadless(settings_dict):
+            remainder_list = resolveUncategorizedData(cats_dict, uncat_acc_data, settings_dict)
+        else:
+            remainder_list = manuallyCategorizeData(cats_dict, uncat_acc_data, settings_dict, learned=learned)
+        pending_list.extend(remainder_list)
+        if len(remainder_list) > 0:
+            print(f"Warning: {month} still has {len(remainder_list)} uncategorized transactions.")
+
+        # Determine Consumption commitments.
+        sumCategories(cats_dict)
+        cons_commits.append(determineConsumptionCommitments(cats_dict, settings_dict))
+
+    # Calculate category sums and collect the balance and exchange rate for all the months concurrently.
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(calculateResults, months[month][1], months[month][3], settings_dict, credentials,\
+                sum_cons_commit=cons_commit, prefetched=prefetched) for month, cons_commit in zip(sorted_months, cons_commits)]
+        results = [(future.result(), months[month][3]) for month, future in zip(sorted_months, futures)]
+
+    if len(pending_list) > 0 or review:
+        pending_path = savePendingTransactions(pending_list, settings_dict, replace=review)
+        if len(pending_list) > 0:
+            print(f"{len(pending_list)} uncategorized transactions were written to {pending_path} for review.")
+
+    return results
+
+# Adds a list of transactions that were not categorized when importing to the pending review file given by
+# the setting "pending_review_file" (default pending_review.json), so that they can be reviewed later with
+# --review-pending. If replace is True, the transactions already in the file are replaced instead. Returns the path of
+# the file.
+def savePendingTransactions(pending_list, settings_dict, replace=False):
+    pending_path = getPendingPath(settings_dict)
+    pending_dict = {'transactions' : []}
+    if os.path.isfile(pending_path) and not replace:
+        with open(pending_path, 'r') as f:
+            pending_dict = json.load(f)
+
+    pending_dict['transactions'].extend(pending_list)
+    saveDictToJson(pending_dict, pending_path, default=serializeResultObject)
+    return pending_path
+
+# Returns the path of the pending review file given by the setting "pending_review_file".
+def getPendingPath(settings_dict):
+    return os.path.normpath(settings_dict.get('pending_review_file', 'pending_review.json'))
+
+# Returns the list of the transactions in the pending review file (see savePendingTransactions).
+def loadPendingTransactions(settings_dict):
+    pending_path = getPendingPath(settings_dict)
+    if not os.path.isfile(pending_path):
+        return []
+    with open(pending_path, 'r') as f:
+        return loadCategoryTransactions(None, json.load(f)['transactions'])
 
 # Takes the path to a CSV file, checks if the path is valid and then processes the transactions
-# contained in it into a results dictionary
+# contained in it into one results dictionary for each month. Returns a list of (results_dict, tally) tuples.
 def importResultsFromCSV(import_path, settings_dict, credentials):
 
     import_path = os.path.normpath(import_path)
     # Check if it is a valid file path
     if not os.path.isfile(import_path):
-        parser.print_usage(sys.stderr)
         eprint(f"ERROR: {import_path} is invalid file-path")
         exit(-1)
 
-    # Now attempt to import the file.
-    accounting_data = importAndValidateCSV(import_path)
-
-    cats_dict, remainder_list = categorizeExpenses(accounting_data, settings_dict)
-    if len(remainder_list) > 0:
-        print(f"Warning: The file {import_path} still has {len(remainder_list)} uncategorized transactions.")
-
-    # Determine Consumption commitments and calculate category sums.
-    results_dict = calculateResults(cats_dict, accounting_data, settings_dict, credentials)
-
-    return results_dict, accounting_data
+    cache = CategoryCache(settings_dict)
+    learned = LearnedRules()
+    results = importResultsFromCSVFiles([import_path], settings_dict, credentials, cache=cache, learned=learned)
+    if len(results) == 0:
+        exit(-1)
+    cache.save()
+    learned.save()
+
+    return results
+
+# Takes the argument given to --import and returns the sorted list of CSV files it refers to. The argument can be
+# the path to a single file, a directory, in which case all the CSV files in it are used, or a glob pattern.
+def expandImportPaths(import_path):
+    if os.path.isdir(import_path):
+        paths = glob.glob(os.path.join(import_path, "*.csv"))
+    elif glob.has_magic(import_path):
+        paths = glob.glob(import_path)
+    else:
+        paths = [import_path]
+    return sorted([os.path.normpath(path) for path in paths if os.path.isfile(path)])
 
 # Reads a file specified from the file-path assuming that it is a CSV file containing transactions.
 # Categorizes these transactions in categories defined in the settings_dict and produces a monthly overview
@@ -38,24 +247,94 @@ def importResultsFromCSV(import_path, settings_dict, credentials):
 # into spreadsheet programs.
 def processCSVTransactionsToMonthlyOverview(file_path, settings_dict):
 
-    credentials = loadCredentials()
+    credentials = loadCredentials(headless=isHeadless(settings_dict))
+    store = getResultsStore(settings_dict)
 
-    results_dict, accounting_data = importResultsFromCSV(file_path, settings_dict, credentials)
+    # The file might contain several months, which are processed into separate overviews.
+    for results_dict, tally in importResultsFromCSV(file_path, settings_dict, credentials):
 
-    # Print income to console
-    print("\nIncome transactions:")
-    printIncome(accounting_data, settings_dict)
+        # Print income to console
+        print("\nIncome transactions:")
+        printIncome(tally.income_list, settings_dict)
 
-    # Print overview over results
-    printResults(results_dict)
-    # Generate output files (.pdf and .csv) and copy to clipboard.
-    exportResults(results_dict, settings_dict)
+        # Print overview over results
+        printResults(results_dict)
+        # Generate output files (.pdf and .csv) and copy to clipboard.
+        exportResults(results_dict, settings_dict)
 
-    # Save results to file.
-    results_fn =  getSaveFileName(accounting_data[0]['date_book'])
-    # We have to first convert all the datetime objects to strings using .isoformat()
-    saveResults(results_dict, results_fn)
+        # Save results to file.
+        results_fn =  getSaveFileName(tally.start_date)
+        # We have to first convert all the datetime objects to strings using .isoformat()
+        saveResults(results_dict, results_fn, silent=isHeadless(settings_dict), store=store)
+
+    return
+
+# Saves the results imported from csv files. If no save path is given, it is generated from the month of the
+# imported data. If there already exists a file at the save path, the imported results are added to the results
+# in this file. Returns the saved results dictionary.
+def saveImportedResults(results_dict, tally, save_path, store=None):
+    results_dict, save_path, dont_ask = combineImportedResults(results_dict, tally, save_path, store)
+    saveResults(results_dict, save_path, silent=dont_ask, store=store)
+    return results_dict
+
+# Does the work of saveImportedResults except saving. Returns the combined results dictionary, the save path and
+# whether the results already existed.
+def combineImportedResults(results_dict, tally, save_path, store=None):
+    if save_path == '' or save_path == None:
+        print("No save file name specified. Generating from imported data.")
+        # This means that no save-file argument was given. However an existing results file might still exist.
+        # Try to find it by using the default file name of the current results.
+
+        # Set the save filename according to the date in the accounting data
+        save_path = getSaveFileName(tally.start_date)
+
+    save_path = os.path.normpath(save_path)
+    dont_ask = False
+    if resultsExist(save_path, store):
+        print(f"Existing file detected at {save_path}.\nCombining with the imported information.")
+        # We are now in a situation where we need to add the imported results into the existing file-information
+        # and save this.
+
+        old_results = importOldResults(save_path, store)
+        results_dict = mergeResults(old_results, results_dict)
+        dont_ask = True
+
+    return results_dict, save_path, dont_ask
+
+# Moves the results files referred to by the argument given to --migrate-sqlite into the SQLite database given by the
+# setting "results_database" (see results_database.py). All the files are stored in a single database transaction.
+def migrateResultsToDatabase(results_path, settings_dict):
+    results_paths = expandResultsPaths(results_path)
+    if len(results_paths) == 0:
+        eprint("ERROR: Could not find any results files to migrate")
+        exit(-1)
+
+    store = ResultsDatabase(settings_dict.get('results_database', 'results.sqlite'))
+    results_list = [(importOldResults(path), path) for path in results_paths]
+    store.saveMany(results_list)
+    store.close()
+    updateResultsIndex(results_list)
+    print(f"Migrated {len(results_paths)} results files to {store.path}.")
+    print("Set \"results_backend\" : \"sqlite\" in settings.conf to use the database.")
+    return
+
+# Moves the learned rules where the same category has been chosen at least min_count times into the regexes of the
+# categories in the settings file.
+def promoteRules(min_count, settings_file = "settings.conf"):
+    # Load the settings file again, so that only the promoted rules are changed in it.
+    settings_dict = loadJsonFile(settings_file)
+    learned = LearnedRules()
+
+    promoted = promoteLearnedRules(learned, settings_dict, min_count)
+    if len(promoted) == 0:
+        print(f"No learned rules have been chosen at least {min_count} times.")
+        return
 
+    updateTextFile(settings_file, lambda text: insertPromotedRegexes(text, promoted))
+    learned.save()
+    for regex, category_name in promoted:
+        print(f"{category_name}: {regex}")
+    print(f"Added {len(promoted)} learned rules to {settings_file}.")
     return
 
 # Implements the logic of the command-line arguments.
@@ -63,6 +342,9 @@ def advancedUsage(parser, settings_dict):
 
     cli_input = parser.parse_args()
 
+    # In headless mode nothing should wait for input from the user.
+    if cli_input.headless:
+        settings_dict['headless'] = True
 
     # First we encrypt and save credentials, if that was the point of the invocation
     if cli_input.encrypt:
@@ -70,38 +352,135 @@ def advancedUsage(parser, settings_dict):
         encryptCredentialsToFile(credentials)
         return
 
-    # We start by seeing if an import argument was given
-    no_results = False
-    import_path = cli_input.imp
-    if import_path != '' and import_path != None:
+    # Similarly, we promote learned rules to regexes in the settings file if that was the point
+    if cli_input.promote_rules != None:
+        promoteRules(cli_input.promote_rules)
+        return
 
-        credentials = loadCredentials()
+    # Or move the saved json results files into the SQLite database
+    if cli_input.migrate_sqlite != None:
+        migrateResultsToDatabase(cli_input.migrate_sqlite, settings_dict)
+        return
 
-        print(f"Importing account information from {import_path}")
-        results_dict, accounting_data = importResultsFromCSV(import_path, settings_dict, credentials)
+    # The results are either stored in json files, or in the store chosen in the settings.
+    store = getResultsStore(settings_dict)
+
+    # Or report the results of several months
+    if cli_input.report:
+        for month in [cli_input.from_month, cli_input.to_month]:
+            if month != None and not re.fullmatch(r'\d{4}-\d{2}', month):
+                parser.print_usage(sys.stderr)
+                eprint(f"ERROR: {month} is not a month of the form YYYY-MM")
+                exit(-1)
+        index = loadResultsIndex(store)
+        printReport(index.months(cli_input.from_month, cli_input.to_month))
+        return
 
-        # Now we need to determine if there exists a file which the imported statements should be added to.
-        save_path = cli_input.save_file
-        if save_path == '' or save_path == None:
-            print("No save file name specified. Generating from imported data.")
-            # This means that no save-file argument was given. However an existing results file might still exist.
-            # Try to find it by using the default file name of the current results. 
-    
-            # Set the save filename according to the date in the accounting data
-            save_path = getSaveFileName(accounting_data[0]['date_book'])
+    # Or re-categorize the transactions in saved results files with the current settings
+    if cli_input.recategorize != None:
+        results_paths = expandResultsPaths(cli_input.recategorize, store)
+        if len(results_paths) == 0:
+            eprint("ERROR: Could not find any results files to re-categorize")
+            exit(-1)
+        recategorizeResultsFiles(results_paths, settings_dict, store=store)
+        return
 
-        save_path = os.path.normpath(save_path)
-        dont_ask = False
-        if os.path.isfile(save_path):
-            print(f"Existing file detected at {save_path}.\nCombining with information imported from {import_path}.")
-            # We are now in a situation where we need to add the imported results into the existing file-information
-            # and save this.
+    # We start by seeing if an import argument was given
+    no_results = False
+    import_path = cli_input.imp
+    importing = import_path != '' and import_path != None
+    if [importing, cli_input.sync, cli_input.review_pending].count(True) > 1:
+        parser.print_usage(sys.stderr)
+        eprint("ERROR: Only one of --import, --sync and --review-pending can be used at a time")
+        exit(-1)
+    if importing or cli_input.sync or cli_input.review_pending:
+
+        if importing:
+            import_paths = expandImportPaths(import_path)
+            if len(import_paths) == 0:
+                parser.print_usage(sys.stderr)
+                eprint(f"ERROR: {import_path} does not contain any csv files")
+                exit(-1)
+        if cli_input.review_pending:
+            if isHeadless(settings_dict):
+                parser.print_usage(sys.stderr)
+                eprint("ERROR: --review-pending asks for the categories of the transactions and can not run headless")
+                exit(-1)
+            pending_list = loadPendingTransactions(settings_dict)
+            if len(pending_list) == 0:
+                print(f"There are no transactions in {getPendingPath(settings_dict)} to review.")
+                return
+
+        credentials = loadCredentials(headless=isHeadless(settings_dict))
+
+        # The index of previously imported transactions makes sure that transactions are only imported once,
+        # even if the same file is imported again or several files cover overlapping periods.
+        index = TransactionIndex()
+        # The cache remembers the categories of transaction texts from earlier imports, while the learned rules
+        # remember the categories the user has chosen manually.
+        cache = CategoryCache(settings_dict)
+        learned = LearnedRules()
+        # The profiler records how often each regex is evaluated and matches, and the time spent on it.
+        profiler = RuleProfiler(settings_dict) if cli_input.profile_rules else None
+
+        # The high-water marks of the accounts synced from the Sbanken API.
+        sync_state = SyncState() if cli_input.sync else None
+
+        if importing:
+            print(f"Importing account information from {', '.join(import_paths)}")
+            results = importResultsFromCSVFiles(import_paths, settings_dict, credentials, index=index, cache=cache, learned=learned,\
+                    profiler=profiler, save_path=cli_input.save_file)
+        elif cli_input.review_pending:
+            pending_path = getPendingPath(settings_dict)
+            print(f"Reviewing the {len(pending_list)} transactions in {pending_path}")
+            # The pending transactions are already in the transaction index, so they are categorized without it. The
+            # regexes and learned rules may have changed since they were imported.
+            file_results = [autoCategorizeTransactions(pending_path, pending_list, settings_dict, cache=cache, learned=learned,\
+                    profiler=profiler)[:2]]
+            results = importResultsFromCategorized(file_results, settings_dict, credentials, learned, cli_input.save_file, review=True)
+        else:
+            print("Synchronizing transactions from the Sbanken API")
+            try:
+                account_results = autoCategorizeSyncedTransactions(credentials, settings_dict, sync_state, index, cache, learned, profiler)
+            except Exception as e:
+                eprint(e)
+                eprint("ERROR: Could not get the transactions from the Sbanken API")
+                exit(-1)
+            results = importResultsFromCategorized(account_results, settings_dict, credentials, learned, cli_input.save_file)
+        cache.save()
+        learned.save()
+
+        if profiler != None:
+            print("\nRegex profile:")
+            profiler.printReport()
+            profiler.save()
+
+        # Now we need to determine if there exists a file which the imported statements should be added to. It has
+        # already been checked that the results are from a single month if a save file is given.
+        save_path = cli_input.save_file
 
-            old_results = importOldResults(save_path)
-            results_dict = addResults(old_results, results_dict)
-            dont_ask = True
+        if len(results) > 0 and store != None:
+            # All the months are saved in a single database transaction.
+            combined = [combineImportedResults(results_dict, tally, save_path, store) for results_dict, tally in results]
+            store.saveMany([(results_dict, path) for results_dict, path, _ in combined])
+            updateResultsIndex([(results_dict, path) for results_dict, path, _ in combined])
+            results_dict = combined[-1][0]
+            index.save()
+        elif len(results) > 0:
+            # The months are saved to separate files, so this can be done concurrently.
+            with ThreadPoolExecutor() as executor:
+                futures = [executor.submit(saveImportedResults, results_dict, tally, save_path) for results_dict, tally in results]
+                results_dict = [future.result() for future in futures][-1]
+
+            # Only add the new transactions to the index once they have been saved.
+            index.save()
+        else:
+            print("No new transactions to import.")
+            no_results = True
 
-        saveResults(results_dict, save_path, silent=dont_ask)
+        # The synced transactions have been saved, or were already imported, so the next sync can start after them.
+        if sync_state != None:
+            sync_state.save()
 
     else: # We can assume that no import file path was given, however an already existing file with results might still
         # exist. This file could be used with -p or -e to generate output.
@@ -114,9 +493,10 @@ def advancedUsage(parser, settings_dict):
             eprint(f"Warning: no save-file specified. Attempting to load {save_path}")
 
         save_path = os.path.normpath(save_path)
-        if os.path.isfile(save_path):
+        if resultsExist(save_path, store):
             print(f"Importing previously saved data from {save_path}")
-            results_dict = importOldResults(save_path)
+            # Printing and exporting the results only needs their summary.
+            results_dict = importOldResults(save_path, store, summary_only=True)
         else:
             # In this case we have failed to find any old results and also failed to import any new ones.
             no_results = True
@@ -194,11 +574,21 @@ def main(argv):
         parser = argparse.ArgumentParser(prog='monthly_accounting.py',
         description='Categorize and generate financial figures for an individuals spending over a certain month. Do this by reading the account statements provided as a csv-file exported from Sbanken.')
 
-        parser.add_argument('-i', '--import', metavar='<csv file>', help='Import expenses in %(metavar)s into categories and store them in an output json file named after the month-year (-s can be used to specify this). ', dest='imp')
+        parser.add_argument('-i', '--import', metavar='<csv file>', help='Import expenses in %(metavar)s into categories and store them in an output json file named after the month-year (-s can be used to specify this). %(metavar)s can also be a directory or a glob pattern (in quotes), in which case all the csv files are imported in parallel and stored in one json file per month.', dest='imp')
         parser.add_argument('-p', '--print', action='store_true', help='Looks for a saved json file and only prints output (does not generate pdfs etc.)', dest='pri')
         parser.add_argument('-e', '--export', action='store_true', help='Looks for an already saved json file and outputs the results in this file by creating plot, generating ouput csv file and copying its content to the clipboard.')
         parser.add_argument('--encrypt', action='store_true', help='Attempts to encrypt credentials stored in cleartext in the credentials folder with a password. Then saves the encrypted credentials to a file `api_credentials.json` located in the script folder.')
+        parser.add_argument('--promote-rules', metavar='<min count>', type=int, nargs='?', const=2, help='Adds the categories learned from manually categorized transactions to the regexes in settings.conf, if the same category has been chosen at least %(metavar)s times (default 2).')
+        parser.add_argument('--recategorize', metavar='<json file>', nargs='?', const='', help='Categorizes the transactions in the saved results in %(metavar)s again with the current regexes in settings.conf. %(metavar)s can also be a directory or a glob pattern (in quotes). By default all the results files in the current folder are used. Transactions not matching any regex keep their category.')
+        parser.add_argument('--profile-rules', action='store_true', help='Used with --import, --sync or --review-pending to record how often each regex in settings.conf is evaluated and matches, and the time spent on it. The report is printed after the import and saved to rule_profile.json.')
+        parser.add_argument('--migrate-sqlite', metavar='<json file>', nargs='?', const='', help='Moves the saved results in %(metavar)s into the SQLite database given by "results_database" in settings.conf (default results.sqlite). %(metavar)s can also be a directory or a glob pattern (in quotes). By default all the results files in the current folder are used.')
+        parser.add_argument('--sync', action='store_true', help='Gets the transactions since the last sync from all the accounts in the Sbanken API instead of importing a csv file, and processes them like --import. The first sync starts at "sync_start_date" in settings.conf (YYYY-MM-DD), or the start of the current month.')
+        parser.add_argument('--review-pending', action='store_true', help='Asks for the categories of the transactions written to the pending review file by --headless or skipped when categorizing, and adds them to the saved results of their months. The transactions that are skipped again are kept in the file.')
+        parser.add_argument('--report', action='store_true', help='Prints the income, expenses, profit and consumption commitments of each month with saved results, and the expenses of each category in each month. Use --from and --to to choose the months.')
+        parser.add_argument('--from', metavar='<YYYY-MM>', help='The first month included by --report.', dest='from_month')
+        parser.add_argument('--to', metavar='<YYYY-MM>', help='The last month included by --report.', dest='to_month')
         parser.add_argument('-s', '--save-file', metavar='<json file-path>', help='Specifies the name of the json-file used to save the results.')
+        parser.add_argument('--headless', action='store_true', help='Never asks for input, e.g. for running scheduled imports. Uncategorized transactions are put in the "fallback_category" in settings.conf or written to a pending review file, consumption commitments exclude the transactions matching "consumption_commitment_exclude_regexes", and the password of the encrypted credentials is read from the environment variable ACCOUNTING_PASSWORD.')
         parser.add_argument('--income', metavar='<csv file>', help='Imports the file in %(metavar)s, but instead of categorizing expenses, prints the income statements contained.')
 
         advancedUsage(parser, settings_dict)
@@ -0,0 +1,174 @@
+# Here we collect the functions for re-categorizing the transactions in saved results files, e.g. after the regexes in
+# settings.conf have been changed. A whole history of results files can contain millions of transactions, so the
+# texts are categorized in chunks in a pool of processes, each compiling the rules once.
+#
+# The transactions of all the results files are collected into one list, and each distinct text is only categorized
+# once. The categories of the chunks are returned in the same order as the texts, so that every transaction can be
+# put in its new category while keeping the order of the transactions. Transactions not matching any rule keep their
+# old category, and the consumption commitments determined on import are kept as they are.
+
+from results_dictionary import importOldResults, saveResults
+from results_database import resultsName
+from categories_dictionary import CategoryMatcher, initializeCategories, sumCategories, generateSettings, generateTexts
+from concurrent.futures import ProcessPoolExecutor
+from tabulate import tabulate
+import fnmatch
+import glob
+import time
+import sys
+import os
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# The matcher of each worker process, created once by initializeWorker.
+worker_matcher = None
+
+# Compiles the rules in settings_dict once in a worker process.
+def initializeWorker(settings_dict):
+    global worker_matcher
+    worker_matcher = CategoryMatcher(settings_dict)
+    return
+
+# Returns the names of the categories matching a chunk of texts, or None for texts not matching any category.
+def categorizeChunk(texts):
+    return [worker_matcher.categorize(text) for text in texts]
+
+# Categorizes a list of texts in chunks of chunk_size texts in a pool of processes. Progress and throughput are
+# printed as the chunks finish. Returns the list of category names (or None) in the same order as the texts.
+def categorizeTexts(texts, settings_dict, chunk_size = DEFAULT_CHUNK_SIZE, max_workers = None):
+    start = time.perf_counter()
+    if len(texts) <= chunk_size:
+        initializeWorker(settings_dict)
+        categories = categorizeChunk(texts)
+        printProgress(len(texts), len(texts), start)
+        return categories
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    categories = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initializeWorker, initargs=(settings_dict,)) as executor:
+        # map returns the results in the order of the chunks.
+        for chunk_categories in executor.map(categorizeChunk, chunks):
+            categories.extend(chunk_categories)
+            printProgress(len(categories), len(texts), start)
+    return categories
+
+# Prints how many of the rows have been categorized and the number of rows per second so far.
+def printProgress(done, total, start):
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    end = "\n" if done == total else ""
+    print(f"\rCategorized {done}/{total} rows ({round(done / elapsed)} rows/s)", end=end, flush=True)
+    return
+
+# Takes the argument given to --recategorize and returns the sorted list of results files it refers to. The argument
+# can be the path to a single file, a directory or a glob pattern. By default all the results files in the current
+# folder are used. If a store is given, the names of the results in it matching the argument are returned instead.
+def expandResultsPaths(results_path, store=None):
+    if store != None:
+        if results_path == '' or results_path == None:
+            return store.names()
+        return [name for name in store.names() if fnmatch.fnmatch(name, resultsName(results_path))]
+
+    if results_path == '' or results_path == None:
+        results_path = '.'
+    if os.path.isdir(results_path):
+        results_path = os.path.join(results_path, "monthly_results_*.json")
+    if os.path.isfile(results_path):
+        return [os.path.normpath(results_path)]
+    return sorted([os.path.normpath(path) for path in glob.glob(results_path) if os.path.isfile(path)])
+
+# Returns a new categories dictionary where the transactions of cats_dict are put in the categories given by
+# new_categories, a list with one category name (or None) for each transaction in the order of cats_dict. Transactions
+# with None keep their old category. The sums of the categories are updated.
+def recategorizeCategories(cats_dict, new_categories, settings_dict):
+    new_cats_dict = initializeCategories(settings_dict)
+    i = 0
+    for old_name in cats_dict:
+        for transaction in cats_dict[old_name]['transactions']:
+            name = new_categories[i] if new_categories[i] != None else old_name
+            transaction.category = name
+            # Categories removed from the settings are kept for the transactions still in them.
+            new_cats_dict.setdefault(name, {"transactions" : [], "sum_out" : 0})['transactions'].append(transaction)
+            i += 1
+
+    sumCategories(new_cats_dict)
+    return new_cats_dict
+
+# Re-categorizes the transactions in the results files in results_paths with the rules in settings_dict and saves
+# the files again, or the results in the store if it is given. Returns the number of transactions that changed category.
+def recategorizeResultsFiles(results_paths, settings_dict, chunk_size = DEFAULT_CHUNK_SIZE, store = None):
+    results_list = [importOldResults(path, store) for path in results_paths]
+
+    # Collect the distinct texts of all the files, keeping the row order of the transactions.
+    texts = []
+    text_positions = {}
+    rows = []
+    for results_dict in results_list:
+        for cat_dict in results_dict['categories'].values():
+            for transaction in cat_dict['transactions']:
+                text = transaction['text']
+                if text not in text_positions:
+                    text_positions[text] = len(texts)
+                    texts.append(text)
+                rows.append(text_positions[text])
+
+    print(f"Re-categorizing {len(rows)} transactions ({len(texts)} distinct texts) in {len(results_paths)} files")
+    categories = categorizeTexts(texts, settings_dict, chunk_size)
+
+    changed = 0
+    row = 0
+    for path, results_dict in zip(results_paths, results_list):
+        cats_dict = results_dict['categories']
+        new_categories = []
+        for old_name in cats_dict:
+            for transaction in cats_dict[old_name]['transactions']:
+                name = categories[rows[row]]
+                if name != None and name != old_name:
+                    changed += 1
+                new_categories.append(name)
+                row += 1
+
+        results_dict['categories'] = recategorizeCategories(cats_dict, new_categories, settings_dict)
+        # Investments are not counted as expenses, as in results_dictionary.calculateResults.
+        results_dict['sum_out'] = sum([cat_dict['sum_out'] for name, cat_dict in results_dict['categories'].items() if name != 'investments'])
+        saveResults(results_dict, path, silent=True, store=store)
+
+    print(f"{changed} transactions changed category.")
+    return changed
+
+# ----------------------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------------------
+
+# Times the categorization of n_rows synthetic transaction texts in a single process compared to chunks in a pool of
+# processes, and checks that they give the same categories in the same order.
+def benchmarkRecategorization(n_rows = 200000, n_categories = 40, n_patterns = 10):
+    settings_dict = generateSettings(n_categories, n_patterns)
+    texts = generateTexts(n_rows, n_categories, n_patterns)
+
+    start = time.perf_counter()
+    matcher = CategoryMatcher(settings_dict)
+    serial = [matcher.categorize(text) for text in texts]
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pooled = categorizeTexts(texts, settings_dict)
+    pooled_time = time.perf_counter() - start
+
+    if serial != pooled:
+        raise Exception("ERROR: The process pool gave different categories")
+
+    headers = ["Categorization", "Time [s]", "Rows / s"]
+    data = [["single process", round(serial_time, 3), round(n_rows / serial_time)],\
+            [f"chunks in {os.cpu_count()} processes", round(pooled_time, 3), round(n_rows / pooled_time)]]
+    print(tabulate(data, headers=headers, disable_numparse=True, tablefmt="rst"))
+    print(f"Speedup: {round(serial_time / pooled_time, 1)}x")
+    return
+
+# Running this file runs the benchmark. Optional arguments give the number of rows, categories and patterns
+# per category.
+def main(argv):
+    benchmarkRecategorization(*[int(arg) for arg in argv])
+    return
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -0,0 +1,128 @@
+# Here we collect the functions concerning the SQLite backend for the results. Instead of one json file for each
+# month, the results can be stored in a single SQLite database, which makes it possible to answer questions across
+# months without loading every results file. The backend is chosen with the setting "results_backend" (see
+# getResultsStore), and the existing json files can be moved into the database with --migrate-sqlite.
+#
+# Each results dictionary is stored under a name, which is the file name it would have had as a json file, e.g.
+# monthly_results_2023-02.json. The database has the tables
+#   summaries: the figures of each results dictionary (see results_dictionary.py), one row per name.
+#   categories: the categories of each results dictionary in their order, with the sum of their expenses.
+#   transactions: the transactions of each category in their order, with the amounts in øre.
+#   balance_snapshots: the total balance and exchange rate every time results have been saved.
+# Dates are stored as isoformatted strings, so that they sort and compare correctly in SQL.
+
+from accounting_data import Transaction
+from datetime import datetime
+import sqlite3
+import os
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    name TEXT PRIMARY KEY,
+    sum_in REAL, sum_out REAL, sum_cons_commit REAL, total_balance REAL, date TEXT, nok_mbtc REAL, mbtc REAL,
+    start_date TEXT, end_date TEXT
+);
+CREATE TABLE IF NOT EXISTS categories (
+    name TEXT, category TEXT, position INTEGER, sum_out REAL,
+    PRIMARY KEY (name, category)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    name TEXT, category TEXT, position INTEGER, date_book TEXT, date_rent TEXT, account_to TEXT, type TEXT, text TEXT,
+    out_ore INTEGER, in_ore INTEGER, archive_ref TEXT
+);
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    date TEXT, name TEXT, total_balance REAL, nok_mbtc REAL, mbtc REAL
+);
+CREATE INDEX IF NOT EXISTS transactions_name ON transactions (name, category, position);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date_book);
+CREATE INDEX IF NOT EXISTS transactions_category ON transactions (category);
+CREATE INDEX IF NOT EXISTS transactions_text ON transactions (text);
+CREATE INDEX IF NOT EXISTS summaries_start_date ON summaries (start_date);
+"""
+
+SUMMARY_KEYS = ['sum_in', 'sum_out', 'sum_cons_commit', 'total_balance', 'date', 'nok_mbtc', 'mbtc', 'start_date', 'end_date']
+DATE_KEYS = ['date', 'start_date', 'end_date']
+
+
+class ResultsDatabase:
+    def __init__(self, path = 'results.sqlite'):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    # Returns True if results are stored under the name of path.
+    def contains(self, path):
+        row = self.connection.execute("SELECT 1 FROM summaries WHERE name = ?", (resultsName(path),)).fetchone()
+        return row != None
+
+    # Returns the sorted list of the names of all the stored results.
+    def names(self):
+        return [row[0] for row in self.connection.execute("SELECT name FROM summaries ORDER BY name")]
+
+    # Stores a results dictionary under the name of path, replacing any results stored under the same name.
+    def save(self, results_dict, path):
+        self.saveMany([(results_dict, path)])
+        return
+
+    # Stores a list of (results_dict, path) tuples. All the rows are inserted in batches inside a single database
+    # transaction, so either all or none of the results are stored.
+    def saveMany(self, results_list):
+        with self.connection:
+            for results_dict, path in results_list:
+                name = resultsName(path)
+                for table in ['summaries', 'categories', 'transactions']:
+                    self.connection.execute(f"DELETE FROM {table} WHERE name = ?", (name,))
+
+                summary = [formatValue(results_dict[key]) for key in SUMMARY_KEYS]
+                self.connection.execute("INSERT INTO summaries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [name] + summary)
+
+                cats_dict = results_dict['categories']
+                self.connection.executemany("INSERT INTO categories VALUES (?, ?, ?, ?)",\
+                        [(name, category, i, cats_dict[category]['sum_out']) for i, category in enumerate(cats_dict)])
+                self.connection.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",\
+                        [(name, category, i, trans.date_book.isoformat(), trans.date_rent.isoformat(), trans.account_to,\
+                        trans.tr_type, trans.text, trans.out_ore, trans.in_ore, trans.archive_ref)\
+                        for category in cats_dict for i, trans in enumerate(cats_dict[category]['transactions'])])
+
+                self.connection.execute("INSERT INTO balance_snapshots VALUES (?, ?, ?, ?, ?)",\
+                        (formatValue(results_dict['date']), name, results_dict['total_balance'], results_dict['nok_mbtc'],\
+                        results_dict['mbtc']))
+        return
+
+    # Loads the results dictionary stored under the name of path, in the same format as results_dictionary.importOldResults.
+    def load(self, path):
+        name = resultsName(path)
+        row = self.connection.execute(f"SELECT {', '.join(SUMMARY_KEYS)} FROM summaries WHERE name = ?", (name,)).fetchone()
+        if row == None:
+            raise Exception(f"ERROR: No results named {name} in {self.path}")
+        cats_dict = {}
+        results_dict = {'categories' : cats_dict}
+        results_dict.update(zip(SUMMARY_KEYS, row))
+        for key in DATE_KEYS:
+            results_dict[key] = datetime.fromisoformat(results_dict[key])
+
+        for category, sum_out in self.connection.execute("SELECT category, sum_out FROM categories WHERE name = ? ORDER BY position", (name,)):
+            cats_dict[category] = {'transactions' : [], 'sum_out' : sum_out}
+        query = "SELECT category, date_book, date_rent, account_to, type, text, out_ore, in_ore, archive_ref FROM transactions " +\
+                "WHERE name = ? ORDER BY category, position"
+        for category, date_book, date_rent, account_to, tr_type, text, out_ore, in_ore, archive_ref in self.connection.execute(query, (name,)):
+            trans = Transaction(datetime.fromisoformat(date_book), datetime.fromisoformat(date_rent), account_to, tr_type,\
+                    text, out_ore, in_ore, archive_ref)
+            trans.category = category
+            cats_dict[category]['transactions'].append(trans)
+
+        return results_dict
+
+    def close(self):
+        self.connection.close()
+        return
+
+# Returns the name results are stored under in the database for a results file path.
+def resultsName(path):
+    return os.path.basename(os.path.normpath(path))
+
+# Formats the values of the summary for the database, where dates are stored as isoformatted strings.
+def formatValue(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
@@ -9,7 +9,8 @@
 # sum_cons_commit: sum of expenses that are considered consumption commitments
 # total_balance: the sum of the balances of the accounts in Sbanken at the time of processing
 # date: the date the dictionary was processed / updated
-# nok_mbtc: exchange rate between NOKs and mBTC at the time of processing.
+# nok_mbtc: exchange rate between NOKs and mBTC at the time of processing, or at the end date with the setting
+#   "btc_rate_as_of_end_date" (see btc_api.getNOKPrmBTC).
 # mbtc: current amount of mBTC in the owners posession.
 # start_date: the date of the first processed expense transaction
 # end_date: the date of the last processed expense transaction
@@ -21,19 +22,30 @@
 # Note that dates are stored in datetime-objects
 
 from datetime import datetime
-from aux_functions import formatNumber, eprint, saveDictToJson
-from accounting_data import sumIncome, getTransactionDates
-from categories_dictionary import determineConsumptionCommitments
+from aux_functions import formatNumber, eprint, writeFileAtomically
+from accounting_data import Transaction, transactionFromDict
+from categories_dictionary import determineConsumptionCommitments, sumCategories
+from results_database import ResultsDatabase
+from results_index import ResultsIndex, updateResultsIndex
 from sbanken_api import getTotalBalance
-from btc_api import getNOKPrmBTC
+from btc_api import getNOKPrmBTC, fallbackNOKPrmBTC
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import pairwise
 from tabulate import tabulate
 import matplotlib.pyplot as plt
 import csv
+import glob
+import heapq
 import json
 import os
 
 
 
+# The version of the format of the results files written by saveResults (see writeResultsJson).
+RESULTS_FORMAT = 2
+# The start of the last line of a results file, holding the summary.
+SUMMARY_PREFIX = '"summary": '
+
 # ----------------------------------------------------------------------------------
 # Creation functions
 # ----------------------------------------------------------------------------------
@@ -41,49 +53,96 @@ import os
 def initializeResults(cats_dict):
     return { "categories" : cats_dict, "sum_in" : 0, "sum_out" : 0, "sum_cons_commit" : 0, "total_balance" : 0, "date" : datetime.now(), "nok_mbtc" : 0, "mbtc" : 0, "start_date" : datetime.now(), "end_date" : datetime.now() }
 
+# The number of seconds calculateResults waits for the prefetched balance and exchange rate by default. The setting
+# "prefetch_timeout" overrides it.
+PREFETCH_TIMEOUT = 30
+
+# Returns the date the Bitcoin exchange rate of results ending at end_date is taken as of. This is end_date if the
+# setting "btc_rate_as_of_end_date" is true, so that importing an old month again gives the same rate. Otherwise it is
+# None, meaning the current rate.
+def getRateDate(settings_dict, end_date):
+    if settings_dict != None and settings_dict.get('btc_rate_as_of_end_date', False):
+        return end_date
+    return None
+
+# Starts getting the total balance from the Sbanken API and the Bitcoin exchange rates for results ending at the dates
+# in end_dates (see getRateDate and btc_api.getNOKPrmBTC) in background threads, so that the network calls are done
+# while the user categorizes transactions. Returns a dictionary with the keys 'total_balance', with a future (see
+# concurrent.futures) as value, and 'nok_mbtc', with a dictionary of the rate dates and futures as value. Without
+# credentials the total balance is not fetched and its value is None. The URLs of the Sbanken API may be given in
+# settings_dict (see sbanken_api.getClient).
+def prefetchBalances(credentials, settings_dict=None, end_dates=[]):
+    executor = ThreadPoolExecutor(max_workers=2)
+    prefetched = {'total_balance' : None, 'nok_mbtc' : {}}
+    for rate_date in set([getRateDate(settings_dict, end_date) for end_date in end_dates]):
+        prefetched['nok_mbtc'][rate_date] = executor.submit(getNOKPrmBTC, settings_dict, rate_date)
+    if len(credentials) > 0:
+        prefetched['total_balance'] = executor.submit(getTotalBalance, credentials, settings_dict)
+    # The threads finish on their own. The executor is not waited for here.
+    executor.shutdown(wait=False)
+    return prefetched
+
+# Returns the result of a prefetched future, waiting at most timeout seconds for it. If the call failed or did not
+# finish in time, the error is printed together with the reason (see http_client.RequestFailed) and default is
+# returned.
+def collectPrefetched(future, timeout, default, error):
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        eprint(f"{error}: No reply within {timeout} seconds")
+    except Exception as e:
+        eprint(f"{error}: {e}")
+    return default
+
 # Takes the completed category lists and calculates the sum in and out of the transactions
 # contained in them: for each and also totally. Additionally determines the consumption commitment.
-def calculateResults(cats_dict, accounting_data, settings_dict, credentials):
+# The income sum and the dates are taken from the tally (see accounting_data.AccountingTally) that the
+# accounting data was streamed through. If sum_cons_commit is given, the consumption commitments have already
+# been determined and the user is not asked about them, which makes it safe to run the function in a separate thread.
+# The total balance and the exchange rate are taken from prefetched (see prefetchBalances), which should be started
+# as soon as the accounting data is loaded. Otherwise they are fetched here.
+def calculateResults(cats_dict, tally, settings_dict, credentials, sum_cons_commit=None, prefetched=None):
+    if prefetched == None:
+        prefetched = prefetchBalances(credentials, settings_dict, [tally.end_date])
     results_dict = initializeResults(cats_dict)
 
     cats_dict = results_dict['categories']
     cat_keys = cats_dict.keys()
 
-    for cat_key in cat_keys:
-        transaction_list = cats_dict[cat_key]['transactions']
-        cats_dict[cat_key]['sum_out'] = sum([trans['out'] for trans in transaction_list])
+    sumCategories(cats_dict)
 
-    # Calculate sum of income directly from the accounting data
-    results_dict['sum_in'] = sumIncome(accounting_data, settings_dict)
+    # The sum of income was calculated directly from the accounting data as it was read
+    results_dict['sum_in'] = tally.sum_in
 
     # We remove investments when calculating the sum of the expenses
     exp_keys = list(cat_keys)
     exp_keys.remove('investments')
     results_dict['sum_out'] = sum([cats_dict[key]['sum_out'] for key in exp_keys])
 
-    results_dict['sum_cons_commit'] = determineConsumptionCommitments(cats_dict, settings_dict)
-    
-    if len(credentials) > 0:
-        try:
-            results_dict['total_balance'] = getTotalBalance(credentials)
-        except:
-            eprint("Error: Could not get total balance")
-            results_dict['total_balance'] = 0
+    if sum_cons_commit is None:
+        sum_cons_commit = determineConsumptionCommitments(cats_dict, settings_dict)
+    results_dict['sum_cons_commit'] = sum_cons_commit
+
+    timeout = settings_dict.get('prefetch_timeout', PREFETCH_TIMEOUT)
+    if prefetched['total_balance'] != None:
+        results_dict['total_balance'] = collectPrefetched(prefetched['total_balance'], timeout, 0, "Error: Could not get total balance")
     else:
         eprint("Error: no credentials supplied. Cannot determine total balance. Setting it to 0")
         results_dict['total_balance'] = 0
-    try:
-        results_dict['nok_mbtc'] = getNOKPrmBTC()
-    except:
-        eprint("Error: Could not get Bitcoin exchange rate")
-        results_dict['nok_mbtc'] = 300
+    # The exchange rate is the current one, unless the settings ask for the rate as of the end of the transactions.
+    rate_date = getRateDate(settings_dict, tally.end_date)
+    future = prefetched['nok_mbtc'].get(rate_date)
+    if future == None:
+        future = prefetchBalances([], settings_dict, [tally.end_date])['nok_mbtc'][rate_date]
+    results_dict['nok_mbtc'] = collectPrefetched(future, timeout, fallbackNOKPrmBTC(settings_dict, rate_date),\
+            "Error: Could not get Bitcoin exchange rate")
 
     # Load amount of current bitcoins from settings
     results_dict['mbtc'] = settings_dict['mBTC']
 
     # Find start and end-date of transactions
-    results_dict['start_date'] = min(getTransactionDates(accounting_data))
-    results_dict['end_date'] = max(getTransactionDates(accounting_data))
+    results_dict['start_date'] = tally.start_date
+    results_dict['end_date'] = tally.end_date
 
     return results_dict
 
@@ -100,33 +159,182 @@ def getOutFileDate(date, format_string = "%Y-%m"):
 def getOutFileDateFromResults(results_dict):
     return getOutFileDate(results_dict['start_date'])
 
-# Converts all the datetime-objects in the results dictionary to strings in an isoformat.
-# The datetime object we needed to convert are deep in the results_dict dictionary, located at
+# Converts all the isoformatted date strings in a results dictionary loaded from json to datetime-objects.
+# The dates we need to convert are deep in the results_dict dictionary, located at
 # results_dict['categories']['<cat name>']['transactions'][<n>]['date_book']/['date_rent']
-def convertResultDatetimesToStrings(results_dict):
-    cats_dict = results_dict['categories']
-    for cat_name in cats_dict:
-        for trans in cats_dict[cat_name]['transactions']:
-            trans['date_book'] = trans['date_book'].isoformat()
-            trans['date_rent'] = trans['date_rent'].isoformat()
-    results_dict['start_date'] = results_dict['start_date'].isoformat()
-    results_dict['end_date'] = results_dict['end_date'].isoformat()
-    results_dict['date'] = results_dict['date'].isoformat()
-    return
-
-
-# Does the same as the above, but in reverse.
 def convertResultStringsToDatetimes(results_dict):
     cats_dict = results_dict['categories']
     for cat_name in cats_dict:
         for trans in cats_dict[cat_name]['transactions']:
             trans['date_book'] = datetime.fromisoformat(trans['date_book'])
             trans['date_rent'] = datetime.fromisoformat(trans['date_rent'])
+    convertSummaryStringsToDatetimes(results_dict)
+    return
+
+# Converts the date strings of a results dictionary that are not part of the transactions to datetime-objects.
+def convertSummaryStringsToDatetimes(results_dict):
     results_dict['start_date'] = datetime.fromisoformat(results_dict['start_date'])
     results_dict['end_date'] = datetime.fromisoformat(results_dict['end_date'])
     results_dict['date'] = datetime.fromisoformat(results_dict['date'])
     return
 
+# Converts a list of transaction dictionaries of the category cat_name loaded from json to Transaction records.
+def loadCategoryTransactions(cat_name, trans_list):
+    transactions = []
+    for trans in trans_list:
+        trans['date_book'] = datetime.fromisoformat(trans['date_book'])
+        trans['date_rent'] = datetime.fromisoformat(trans['date_rent'])
+        transaction = transactionFromDict(trans)
+        transaction.category = cat_name
+        transactions.append(transaction)
+    return transactions
+
+# Replaces the transaction dictionaries loaded from a results file with Transaction records, tagged with the category
+# they are saved in.
+def convertResultDictsToTransactions(results_dict):
+    cats_dict = results_dict['categories']
+    for cat_name in cats_dict:
+        cats_dict[cat_name]['transactions'] = [transactionFromDict(trans) for trans in cats_dict[cat_name]['transactions']]
+        for trans in cats_dict[cat_name]['transactions']:
+            trans.category = cat_name
+    return
+
+# Writes a results dictionary as json to an open file without changing the dictionary. The Transaction records and
+# dates are encoded by serializeResultObject as they are written, and each category is encoded and written on its own,
+# so that the whole results never have to be held in memory as one string.
+#
+# The file follows format version RESULTS_FORMAT, which is still a single json object:
+#   {"format": 2, "categories": {
+#   "<category name>": {"transactions": [...], "sum_out": <num>},
+#   ...
+#   },
+#   "summary": {"sum_in": <num>, ..., "category_sums": {...}, "offsets": {...}}}
+# Each category is on its own line, and the summary on the last line holds all the other figures of the results, the
+# sums of the categories and the byte offset and length of each category. The summary can therefore be read from the
+# end of the file without parsing any transactions (see importResultsSummary).
+def writeResultsJson(results_dict, file):
+    header = f'{{"format": {RESULTS_FORMAT}, "categories": {{\n'
+    file.write(header)
+    position = len(header.encode())
+
+    # The offsets are counted in bytes, so the file must be opened without newline translation (newline='').
+    cats_dict = results_dict['categories']
+    offsets = {}
+    for i, cat_name in enumerate(cats_dict):
+        prefix = json.dumps(cat_name) + ': '
+        encoded = json.dumps({'transactions' : cats_dict[cat_name]['transactions'], 'sum_out' : cats_dict[cat_name]['sum_out']},\
+                default=serializeResultObject)
+        line = prefix + encoded + (',\n' if i < len(cats_dict) - 1 else '\n')
+        offsets[cat_name] = [position + len(prefix.encode()), len(encoded.encode())]
+        file.write(line)
+        position += len(line.encode())
+    file.write('},\n')
+
+    summary = {key : value for key, value in results_dict.items() if key != 'categories'}
+    summary['category_sums'] = {cat_name : cats_dict[cat_name]['sum_out'] for cat_name in cats_dict}
+    summary['offsets'] = offsets
+    file.write(SUMMARY_PREFIX + json.dumps(summary, default=serializeResultObject) + '}')
+    return
+
+# Reads the summary on the last line of a results file of format RESULTS_FORMAT. Returns None for files in the older
+# format, which have no summary.
+def readResultsSummary(file, block_size = 4096):
+    file.seek(0, os.SEEK_END)
+    end = file.tell()
+    # Read blocks backwards from the end until the start of the last line is found.
+    tail = b''
+    while end > 0 and b'\n' not in tail:
+        start = max(0, end - block_size)
+        file.seek(start)
+        tail = file.read(end - start) + tail
+        end = start
+
+    last_line = tail.rsplit(b'\n', 1)[-1].decode()
+    if not last_line.startswith(SUMMARY_PREFIX) or not last_line.endswith('}'):
+        return None
+    return json.loads(last_line[len(SUMMARY_PREFIX):-1])
+
+# Dictionary of a category in results loaded by importResultsSummary. The sum of the category is known from the
+# summary, while the transactions are only read from the results file when they are first needed, whether through
+# indexing, get, iteration or the keys, values and items views.
+class LazyCategory(dict):
+    def __init__(self, cat_name, sum_out, path, offset, length):
+        super().__init__(sum_out = sum_out)
+        self.cat_name = cat_name
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    # Reads the transactions of the category from the results file, unless they have already been read.
+    def load(self):
+        if not super().__contains__('transactions'):
+            with open(self.path, 'rb') as file:
+                file.seek(self.offset)
+                cat_dict = json.loads(file.read(self.length))
+            self['transactions'] = loadCategoryTransactions(self.cat_name, cat_dict['transactions'])
+        return
+
+    def __missing__(self, key):
+        if key != 'transactions':
+            raise KeyError(key)
+        self.load()
+        return self['transactions']
+
+    # The transactions are always there, even before they have been read.
+    def __contains__(self, key):
+        return key == 'transactions' or super().__contains__(key)
+
+    def get(self, key, default=None):
+        if key == 'transactions':
+            self.load()
+        return super().get(key, default)
+
+    def __iter__(self):
+        self.load()
+        return super().__iter__()
+
+    def __len__(self):
+        self.load()
+        return super().__len__()
+
+    def keys(self):
+        self.load()
+        return super().keys()
+
+    def values(self):
+        self.load()
+        return super().values()
+
+    def items(self):
+        self.load()
+        return super().items()
+
+# Loads only the summary of the results file at path, which is enough for printing and exporting the results. The
+# transactions of each category are loaded when they are first used (see LazyCategory). Files in the older format
+# without a summary are loaded completely.
+def importResultsSummary(path):
+    with open(path, 'rb') as file:
+        summary = readResultsSummary(file)
+    if summary == None:
+        return importOldResults(path)
+
+    offsets = summary.pop('offsets')
+    category_sums = summary.pop('category_sums')
+    results_dict = {'categories' : {cat_name : LazyCategory(cat_name, category_sums[cat_name], path, *offsets[cat_name])\
+            for cat_name in category_sums}}
+    results_dict.update(summary)
+    convertSummaryStringsToDatetimes(results_dict)
+    return results_dict
+
+# Used when dumping results to json in order to serialize the Transaction records in the same format as dictionaries.
+# Dates are serialized as isoformatted strings.
+def serializeResultObject(obj):
+    if isinstance(obj, Transaction):
+        return obj.makeDict()
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
 # Creates the name of the save file for the json given a date (default is current date)
 def getSaveFileName(date=datetime.now()):
     out_file_date = getOutFileDate(date)
@@ -138,18 +346,43 @@ def getSaveFileName(date=datetime.now()):
 # Combination functions
 # ----------------------------------------------------------------------------------
 
-# The categories dictionaries a b both have the format
+# Returns the key the transactions in the categories are ordered by, the date they were booked.
+def transactionDate(transaction):
+    return transaction['date_book']
+
+# Sorts a list of transactions by date in place, unless it is already sorted. The lists are usually sorted already,
+# or in reverse order as in some exports, which the sort handles in linear time.
+def sortTransactionsByDate(transactions):
+    if any(transactionDate(a) > transactionDate(b) for a, b in pairwise(transactions)):
+        transactions.sort(key=transactionDate)
+    return transactions
+
+# Merges the categories dictionaries in others into the categories dictionary cats_dict in place. The dictionaries
+# all have the format
 # { '<category name>' : { 'sum_out' : <num>, 'transactions' : [
-#       { 'in': <num>, 'out' : <num, ..}, { ...  }, ... ] }, '<category name2>' : { 'sum_out' : '<num>', 
+#       { 'in': <num>, 'out' : <num, ..}, { ...  }, ... ] }, '<category name2>' : { 'sum_out' : '<num>',
 #   ...}, { ... }, ... }
-def combineCategories(a, b):
-    keys = a.keys()
-    c = {}
-    for key in keys:
-        c[key] = {}
-        c[key]['sum_out'] = a[key]['sum_out'] + b[key]['sum_out']
-        c[key]['transactions'] = a[key]['transactions'] + b[key]['transactions']
-    return c
+# The sums of the categories are added, and the transactions of each category are merged into one list ordered by
+# date in a single pass over all the lists. When the new transactions are all later than the existing ones, which is
+# the usual case when importing month by month, they are just appended. Categories only in others are added to
+# cats_dict. Returns cats_dict.
+def mergeCategories(cats_dict, *others):
+    for other in others:
+        for cat_name in other:
+            cats_dict.setdefault(cat_name, {'transactions' : [], 'sum_out' : 0})
+    for cat_name, cat_dict in cats_dict.items():
+        lists = [sortTransactionsByDate(other[cat_name]['transactions']) for other in others if cat_name in other]
+        cat_dict['sum_out'] += sum([other[cat_name]['sum_out'] for other in others if cat_name in other])
+        lists = [trans_list for trans_list in lists if len(trans_list) > 0]
+        if len(lists) == 0:
+            continue
+
+        transactions = sortTransactionsByDate(cat_dict['transactions'])
+        if len(transactions) == 0 or all(transactionDate(trans_list[0]) >= transactionDate(transactions[-1]) for trans_list in lists):
+            transactions.extend(heapq.merge(*lists, key=transactionDate))
+        else:
+            transactions[:] = heapq.merge(transactions, *lists, key=transactionDate)
+    return cats_dict
 
 # returns the latest dictionary given two results dictionaries.
 def latest(a_dict, b_dict):
@@ -158,23 +391,24 @@ def latest(a_dict, b_dict):
     else:
         return b_dict
 
-# Takes two result dictionaries and combines them into a new result consisting of the sum of the two.
-def addResults(dict1, dict2):
-    # Concatinate the transactions in the different categories.
-    cats_sum = combineCategories(dict1['categories'], dict2['categories'])
-    sum_dict = initializeResults(cats_sum)
-    sum_dict['sum_in'] = dict1['sum_in'] + dict2['sum_in']
-    sum_dict['sum_out'] = dict1['sum_out'] + dict2['sum_out']
-    sum_dict['sum_cons_commit'] = dict1['sum_cons_commit'] + dict2['sum_cons_commit']
-    latest_dict = latest(dict1, dict2)
-    sum_dict['total_balance'] = latest_dict['total_balance']
-    sum_dict['date'] = datetime.now()
-    sum_dict['nok_mbtc'] = latest_dict['nok_mbtc']
-    sum_dict['mbtc'] = latest_dict['mbtc']
-    sum_dict['start_date'] = min(dict1['start_date'], dict2['start_date'])
-    sum_dict['end_date'] = max(dict1['end_date'], dict2['end_date'])
-    return sum_dict
-
+# Merges the results dictionaries in others into the results dictionary results_dict in place, e.g. several partial
+# imports of the same month. The sums and the dates of the first and last transactions are updated from the sums and
+# dates of the other results, without summing the transactions again, and the categories are merged with
+# mergeCategories. The balances are taken from the latest of the results. Returns results_dict.
+def mergeResults(results_dict, *others):
+    mergeCategories(results_dict['categories'], *[other['categories'] for other in others])
+    latest_dict = results_dict
+    for other in others:
+        for key in ['sum_in', 'sum_out', 'sum_cons_commit']:
+            results_dict[key] += other[key]
+        results_dict['start_date'] = min(results_dict['start_date'], other['start_date'])
+        results_dict['end_date'] = max(results_dict['end_date'], other['end_date'])
+        latest_dict = latest(latest_dict, other)
+
+    for key in ['total_balance', 'nok_mbtc', 'mbtc']:
+        results_dict[key] = latest_dict[key]
+    results_dict['date'] = datetime.now()
+    return results_dict
 
 
 # ----------------------------------------------------------------------------------
@@ -186,30 +420,88 @@ def printHelp():
     eprint(":~$ py monthly_accounting.py <accounting csv file>\n")
     eprint("Here <accounting csv file> is the path to the file that contains your exported expenses from Sbanken.")
 
-# Assume the path is to a json file containing a json file dump.
-def importOldResults(path):
+# Returns the store of the results chosen by the setting "results_backend". For "sqlite" this is a ResultsDatabase
+# (see results_database.py) using the file given by the setting "results_database" (default results.sqlite). For the
+# default backend "json" None is returned, meaning that each results dictionary is stored in its own json file.
+def getResultsStore(settings_dict):
+    backend = settings_dict.get('results_backend', 'json')
+    if backend == 'sqlite':
+        return ResultsDatabase(settings_dict.get('results_database', 'results.sqlite'))
+    if backend != 'json':
+        eprint(f"Warning: Unknown results backend {backend}. Using json files.")
+    return None
+
+# Returns True if there are saved results at path, either in the store if it is given or as a json file.
+def resultsExist(path, store=None):
+    if store != None:
+        return store.contains(path)
+    return os.path.isfile(path)
+
+# Assume the path is to a json file containing a json file dump. If a store is given, the results are loaded from
+# it instead.
+# If summary_only is True, only the summary of the results is read and the transactions are loaded when needed (see
+# importResultsSummary).
+def importOldResults(path, store=None, summary_only=False):
+    if store != None:
+        return store.load(path)
+    if summary_only:
+        return importResultsSummary(path)
+
     with open(path, 'r') as file:
         results_dict = json.load(file)
 
+    # In the current format the figures are kept in the summary at the end of the file.
+    if 'format' in results_dict:
+        del results_dict['format']
+        summary = results_dict.pop('summary')
+        del summary['offsets'], summary['category_sums']
+        results_dict.update(summary)
+
     # Now we have to convert all the strings corresponding to dates, back into dates.
     convertResultStringsToDatetimes(results_dict)
+    convertResultDictsToTransactions(results_dict)
 
     return results_dict
 
-# Saves the results dictionary to a file given by output_fn by first transforming all datetime objects
-# into isofrmatted strings.
-def saveResults(results_dict, output_fn, silent=False):
-    if not silent and os.path.isfile(output_fn):
+# Saves the results dictionary to a file given by output_fn, where the datetime objects are written as isoformatted
+# strings (see writeResultsJson). The file is replaced atomically, and results_dict is not changed.
+# If a store is given, the results are saved in it under the name of output_fn instead.
+# In both cases the summary of the results is updated in the results index (see results_index.py).
+def saveResults(results_dict, output_fn, silent=False, store=None):
+    if not silent and resultsExist(output_fn, store):
         choice = input(f"Warning: file {output_fn} already exists. Overwrite? (y/n): ")
         if not ('y' in choice or 'Y' in choice):
             return
-    convertResultDatetimesToStrings(results_dict)
-    saveDictToJson(results_dict, output_fn)
-
-    # Remember to convert back to datetime, since the results_dict might be used later.
-    convertResultStringsToDatetimes(results_dict)
+    if store != None:
+        store.save(results_dict, output_fn)
+    else:
+        writeFileAtomically(output_fn, lambda file: writeResultsJson(results_dict, file), newline='')
+    updateResultsIndex([(results_dict, output_fn)])
     return
 
+# Returns the results index of the current folder (see results_index.py). Results saved before the index existed are
+# added to it first, which only requires reading their summaries, and results that have been deleted since they were
+# saved are removed from it.
+def loadResultsIndex(store=None):
+    index = ResultsIndex()
+    if store != None:
+        names = store.names()
+        stored = set(names)
+        stale = [name for name in index.entries if name not in stored]
+    else:
+        names = [os.path.basename(path) for path in glob.glob("monthly_results_*.json")]
+        # Results saved under other names with -s are kept as long as their files exist.
+        stale = [name for name in index.entries if not os.path.isfile(name)]
+
+    missing = [name for name in names if not index.contains(name)]
+    for name in missing:
+        index.add(importOldResults(name, store, summary_only=True), name)
+    for name in stale:
+        index.remove(name)
+    if len(missing) > 0 or len(stale) > 0:
+        index.save()
+    return index
+
 
 # Takes a dictionary of results and prints it nicely.
 def printResults(results_dict):
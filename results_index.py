@@ -0,0 +1,146 @@
+# Here we collect the functions concerning the results index, which keeps a small summary of every saved results
+# dictionary in the file results_index.json next to the results files. The summary holds the figures of the results
+# and the sums of the categories, but no transactions, so reports across many months (see printReport) only need to
+# read the index instead of every results file.
+#
+# The index is updated by results_dictionary.saveResults every time results are saved. The summaries are stored under
+# the file names of the results, e.g. monthly_results_2023-02.json, and are grouped into months by their start date.
+
+from aux_functions import formatNumber, saveDictToJson
+from accounting_data import getMonthKey
+from datetime import datetime
+from tabulate import tabulate
+import threading
+import json
+import os
+
+INDEX_FILENAME = 'results_index.json'
+# Several months may be saved concurrently, so updates of the index file are done one at a time.
+index_lock = threading.Lock()
+
+
+class ResultsIndex:
+    def __init__(self, folder = '.'):
+        self.path = os.path.join(folder, INDEX_FILENAME)
+        # Dictionary of results file names with summaries (see summarizeResults) as values.
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)['entries']
+
+    # Returns True if there is a summary of the results file with the given name.
+    def contains(self, name):
+        return name in self.entries
+
+    # Adds or replaces the summary of the results saved at path.
+    def add(self, results_dict, path):
+        self.entries[os.path.basename(path)] = summarizeResults(results_dict)
+        return
+
+    # Removes the summary of the results file with the given name, e.g. when the file has been deleted.
+    def remove(self, name):
+        del self.entries[name]
+        return
+
+    # Returns a dictionary with the months (YYYY-mm) from from_month to to_month as keys and the combined summaries of
+    # the results in each month as values. Both limits are optional and included.
+    def months(self, from_month = None, to_month = None):
+        months = {}
+        for summary in sorted(self.entries.values(), key=lambda summary: summary['date']):
+            month = summary['month']
+            if (from_month != None and month < from_month) or (to_month != None and month > to_month):
+                continue
+            if month not in months:
+                months[month] = dict(summary, category_sums = dict(summary['category_sums']))
+            else:
+                combineSummaries(months[month], summary)
+        return {month : months[month] for month in sorted(months)}
+
+    # Writes the index to its json file.
+    def save(self):
+        saveDictToJson({'entries' : self.entries}, self.path)
+        return
+
+# Returns the summary of a results dictionary stored in the index. This works for results loaded with only their
+# summary as well, since only the sums of the categories are used.
+def summarizeResults(results_dict):
+    summary = {'month' : getMonthKey(results_dict['start_date'])}
+    for key in ['sum_in', 'sum_out', 'sum_cons_commit', 'total_balance', 'nok_mbtc', 'mbtc']:
+        summary[key] = results_dict[key]
+    for key in ['date', 'start_date', 'end_date']:
+        summary[key] = results_dict[key].isoformat()
+    cats_dict = results_dict['categories']
+    summary['category_sums'] = {cat_name : cats_dict[cat_name]['sum_out'] for cat_name in cats_dict}
+    return summary
+
+# Adds the sums of the summary b to the summary a of the same month. The balances are taken from the latest of them,
+# as in results_dictionary.mergeResults. The summaries are expected to be combined in the order they were saved.
+def combineSummaries(a, b):
+    for key in ['sum_in', 'sum_out', 'sum_cons_commit']:
+        a[key] += b[key]
+    for key in ['date', 'total_balance', 'nok_mbtc', 'mbtc']:
+        a[key] = b[key]
+    a['start_date'] = min(a['start_date'], b['start_date'])
+    a['end_date'] = max(a['end_date'], b['end_date'])
+    for cat_name, sum_out in b['category_sums'].items():
+        a['category_sums'][cat_name] = a['category_sums'].get(cat_name, 0) + sum_out
+    return
+
+# Adds the summaries of a list of (results_dict, path) tuples to the index in the folder of each path.
+def updateResultsIndex(results_list):
+    with index_lock:
+        indices = {}
+        for results_dict, path in results_list:
+            folder = os.path.dirname(path) or '.'
+            if folder not in indices:
+                indices[folder] = ResultsIndex(folder)
+            indices[folder].add(results_dict, path)
+        for index in indices.values():
+            index.save()
+    return
+
+# Returns the given percentage of a number, or 0 if the total is 0.
+def percentage(num, total):
+    return round(num / total * 100, 2) if total > 0 else 0.0
+
+# Prints a report of the months in a dictionary of month summaries (see ResultsIndex.months): the income, expenses,
+# profit and consumption commitments of each month and of all of them, followed by the expenses of each category in
+# each month.
+def printReport(months):
+    if len(months) == 0:
+        print("No results to report.")
+        return
+    summaries = list(months.values())
+
+    headers = ["Month", "In", "Out", "Profit", "Cons. commit", "Cons. fraction [%]", "Margin [%]"]
+    data = []
+    for month, summary in months.items():
+        profit = summary['sum_in'] - summary['sum_out']
+        data.append([month, formatNumber(summary['sum_in']), formatNumber(summary['sum_out']), formatNumber(profit),\
+                formatNumber(summary['sum_cons_commit']), percentage(summary['sum_cons_commit'], summary['sum_in']),\
+                percentage(profit, summary['sum_in'])])
+    sum_in = sum([summary['sum_in'] for summary in summaries])
+    sum_out = sum([summary['sum_out'] for summary in summaries])
+    sum_cc = sum([summary['sum_cons_commit'] for summary in summaries])
+    data.append(["Total", formatNumber(sum_in), formatNumber(sum_out), formatNumber(sum_in - sum_out), formatNumber(sum_cc),\
+            percentage(sum_cc, sum_in), percentage(sum_in - sum_out, sum_in)])
+    print(f"\nResults from {summaries[0]['month']} to {summaries[-1]['month']}:")
+    print(tabulate(data, headers=headers, colalign=("left",) + ("right",) * 6, disable_numparse=True, tablefmt="rst"))
+
+    # The categories in the order they first appear.
+    cat_names = []
+    for summary in summaries:
+        cat_names += [cat_name for cat_name in summary['category_sums'] if cat_name not in cat_names]
+    headers = ["Category"] + list(months.keys()) + ["Total", "Average"]
+    data = []
+    for cat_name in cat_names:
+        sums = [summary['category_sums'].get(cat_name, 0) for summary in summaries]
+        data.append([cat_name] + [formatNumber(num) for num in sums] + [formatNumber(sum(sums)), formatNumber(sum(sums) / len(sums))])
+    print("\nExpense categories:")
+    print(tabulate(data, headers=headers, colalign=("left",) + ("right",) * (len(headers) - 1), disable_numparse=True, tablefmt="rst"))
+
+    latest = summaries[-1]
+    print(f"\nSbanken Balance at {datetime.fromisoformat(latest['date']).strftime('%d/%m/%Y')}:\t{formatNumber(latest['total_balance'])} NOK")
+    print(f"Bitcoin Balance:\t\t{formatNumber(latest['nok_mbtc'] * latest['mbtc'])} NOK")
+    print()
+    return
@@ -0,0 +1,81 @@
+# Here we collect the functions for profiling the regexes in settings.conf. When profiling, every pattern is searched
+# for separately, in the same order as when categorizing (see aux_functions.matchesAnyOne), and the number of
+# evaluations, the number of hits and the time spent is recorded for each category and pattern.
+#
+# The report shows which patterns never match, e.g. because an earlier category always matches first, and which
+# patterns are slow, e.g. because of catastrophic backtracking. Profiling is much slower than the normal
+# categorization, since the patterns are not combined, so it is only done when asked for with --profile-rules.
+
+from tabulate import tabulate
+import time
+import re
+
+from aux_functions import saveDictToJson
+
+# The group name used for the skip regexes in the report.
+SKIP_GROUP = 'skip_regexes'
+
+
+class RuleProfiler:
+    def __init__(self, settings_dict):
+        # Dictionary of group (category) names with dictionaries of patterns and [evaluations, hits, seconds] as values.
+        # All the patterns are added up front, so that patterns that are never evaluated are reported as well.
+        self.stats = {}
+        self.compiled = {}
+        for category in settings_dict['categories']:
+            self.stats[category['name']] = {regex : [0, 0, 0.0] for regex in category['regexes']}
+        self.stats[SKIP_GROUP] = {regex : [0, 0, 0.0] for regex in settings_dict['skip_regexes']}
+
+    # Searches for the pattern regex in a text which is already in lower case, recording the evaluation in the
+    # statistics of the group. Returns True if the pattern matches.
+    def search(self, group, regex, lowered):
+        pattern = self.compiled.get(regex)
+        if pattern == None:
+            pattern = self.compiled[regex] = re.compile(regex)
+
+        start = time.perf_counter()
+        hit = pattern.search(lowered) != None
+        elapsed = time.perf_counter() - start
+
+        stat = self.stats.setdefault(group, {}).setdefault(regex, [0, 0, 0.0])
+        stat[0] += 1
+        stat[1] += hit
+        stat[2] += elapsed
+        return hit
+
+    # Adds the statistics of another profiler, e.g. the copy of the profiler used in another process.
+    def merge(self, stats):
+        for group, patterns in stats.items():
+            for regex, (evaluations, hits, seconds) in patterns.items():
+                stat = self.stats.setdefault(group, {}).setdefault(regex, [0, 0, 0.0])
+                stat[0] += evaluations
+                stat[1] += hits
+                stat[2] += seconds
+        return
+
+    # Returns a list of dictionaries with the statistics of each pattern, the slowest patterns first.
+    def makeRows(self):
+        rows = [{'category' : group, 'pattern' : regex, 'evaluations' : evaluations, 'hits' : hits, 'seconds' : seconds}\
+                for group, patterns in self.stats.items() for regex, (evaluations, hits, seconds) in patterns.items()]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    # Writes the statistics of all the patterns to a json file.
+    def save(self, filename = 'rule_profile.json'):
+        saveDictToJson({'rules' : self.makeRows()}, filename)
+        return
+
+    # Prints a table of the statistics of all the patterns, the slowest patterns first, followed by the patterns that
+    # never matched.
+    def printReport(self):
+        rows = self.makeRows()
+        headers = ["Category", "Pattern", "Evaluations", "Hits", "Time [ms]", "Time / eval [us]"]
+        data = [[row['category'], row['pattern'], row['evaluations'], row['hits'], round(row['seconds'] * 1000, 3),\
+                round(row['seconds'] / max(row['evaluations'], 1) * 1e6, 2)] for row in rows]
+        print(tabulate(data, headers=headers, disable_numparse=True, colalign=("left", "left", "right", "right", "right", "right")))
+
+        dead = [row for row in rows if row['hits'] == 0]
+        if len(dead) > 0:
+            print(f"\n{len(dead)} patterns never matched:")
+            for row in dead:
+                print(f"  {row['category']}: {row['pattern']}")
+        return
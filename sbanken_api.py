@@ -1,30 +1,186 @@
 import sys
 import os
+import json
+import time
+import threading
+import contextlib
 
 from oauthlib.oauth2 import BackendApplicationClient
-import requests
 from requests_oauthlib import OAuth2Session
 import urllib.parse
 
-from credential_protection import loadCredentials
+from credential_protection import loadCredentials, encrypt, decrypt, EncryptionParameters
+from aux_functions import saveDictToJson, eprint
+from http_client import request, callWithRetries, checkResponse, getTimeouts
 
-# Use OAuth2 in order to get an authenticated session. The "secret" is also known as "password" in the Sbanken UI.
-def getAuthenticatedSession(client_id, client_secret):
-    # This follows the procedure for OAuth2 authentication using the "Backend Application Flow"
-    # which is documented at, e.g.: https://requests-oauthlib.readthedocs.io/en/latest/oauth2_workflow.html
+AUTH_URL = "https://auth.sbanken.no"
+API_URL = "https://publicapi.sbanken.no/apibeta/api/v2"
+# The access token is cached in this file in the script folder, next to api_credentials.json.
+TOKEN_CACHE_FILENAME = "sbanken_token.json"
+# Cached tokens expiring within this number of seconds are not used.
+TOKEN_EXPIRY_MARGIN = 60
+# The token cache is encrypted with the client secret, which is already a long random string, so a cheaper key
+# derivation than for the user's password is used.
+TOKEN_CACHE_PARAMETERS = EncryptionParameters(time_cost = 1, memory_cost = 8192, parallelism = 1)
 
-    auth_url = "https://auth.sbanken.no"
-    token_url = f'{auth_url}/identityserver/connect/token'
 
-    # Setup a requests.Session() object.
-    client = BackendApplicationClient(client_id=client_id)
-    session = OAuth2Session(client=client)
-
-    # Do the actual authentication for the session to the API.
-    # This call returns a dictionary of token, but is not needed since it is implicit in the session object.
-    session.fetch_token(token_url=token_url, client_id=client_id, client_secret=client_secret)
-
-    return session
+# Client for the Sbanken API. The client authenticates with OAuth2 using the "Backend Application Flow", documented at,
+# e.g.: https://requests-oauthlib.readthedocs.io/en/latest/oauth2_workflow.html, and uses one session for all the
+# calls to the API, so that the connections are reused.
+#
+# The access token is cached encrypted in the file token_cache until it expires, so later runs within the lifetime
+# of the token do not authenticate again. The URLs can be changed, e.g. to use the local stand-in server in
+# sbanken_mock_server.py, which is reached with plain http, so the client then has to allow insecure transport.
+class SbankenClient:
+    def __init__(self, credentials, auth_url = AUTH_URL, api_url = API_URL, token_cache = TOKEN_CACHE_FILENAME, settings_dict = None,\
+            insecure_transport = False):
+        client_id, client_secret = getCredentials(credentials)
+        # URL-encode the client_id and client_secret. The "secret" is also known as "password" in the Sbanken UI.
+        self.client_id = urllib.parse.quote(client_id)
+        self.client_secret = urllib.parse.quote(client_secret)
+        self.token_url = f'{auth_url}/identityserver/connect/token'
+        self.api_url = api_url
+        # The settings of the timeouts and retries of the calls (see http_client.py).
+        self.settings_dict = settings_dict
+
+        script_folder = os.path.normpath(os.path.dirname(os.path.realpath(__file__)))
+        self.token_cache = os.path.join(script_folder, token_cache)
+
+        # oauthlib refuses plain http unless insecure transport is allowed for the calls of this client.
+        self.insecure_transport = insecure_transport
+
+        self.session = OAuth2Session(client=BackendApplicationClient(client_id=self.client_id))
+        self.authenticated = False
+        # The client may be used by several threads, but should only authenticate once.
+        self.lock = threading.Lock()
+
+    # Makes sure the session has a valid access token, either from the token cache or by authenticating.
+    def authenticate(self, force = False):
+        with self.lock:
+            if self.authenticated and not force:
+                return
+            token = None if force else self.loadToken()
+            if token != None:
+                self.session.token = token
+            else:
+                with allowedTransport(self.insecure_transport):
+                    token = callWithRetries('sbanken', "Sbanken authentication", lambda: self.session.fetch_token(token_url=self.token_url,\
+                            client_id=self.client_id, client_secret=self.client_secret, timeout=getTimeouts(self.settings_dict)),\
+                            self.settings_dict)
+                self.saveToken(token)
+            self.authenticated = True
+        return
+
+    # Returns the cached access token if it is for this client and does not expire soon. Otherwise None is returned.
+    def loadToken(self):
+        if not os.path.isfile(self.token_cache):
+            return None
+        try:
+            with open(self.token_cache, 'r') as f:
+                cache = json.load(f)
+            if cache['client_id'] != self.client_id or cache['token_url'] != self.token_url:
+                return None
+            params = EncryptionParameters(**cache['parameters'])
+            token = json.loads(decrypt(self.client_secret, cache['salt'], cache['token'], params))
+        except Exception:
+            eprint(f"Warning: Could not read the cached Sbanken token in {self.token_cache}. Authenticating again.")
+            return None
+        if token.get('expires_at', 0) - TOKEN_EXPIRY_MARGIN < time.time():
+            return None
+        return token
+
+    # Writes the access token to the token cache, encrypted with the client secret.
+    def saveToken(self, token):
+        salt_str, ciphertext, params = encrypt(self.client_secret, json.dumps(token), params = TOKEN_CACHE_PARAMETERS)
+        cache = {'client_id' : self.client_id, 'token_url' : self.token_url, 'parameters' : params.makeDict(),\
+                'salt' : salt_str, 'token' : ciphertext}
+        try:
+            saveDictToJson(cache, self.token_cache, mode=0o600)
+        except OSError:
+            eprint(f"Warning: Could not write the Sbanken token cache {self.token_cache}")
+        return
+
+    # Calls an endpoint of the API, e.g. "Accounts", with optional query parameters and returns the json reply. If a
+    # cached token has been revoked, the client authenticates again and repeats the call once. Raises
+    # http_client.RequestFailed if the call fails.
+    def get(self, endpoint, params = None):
+        self.authenticate()
+        call = f"Sbanken {endpoint.split('/')[0]}"
+        with allowedTransport(self.insecure_transport):
+            response = request('sbanken', call, self.session, 'GET', f'{self.api_url}/{endpoint}', self.settings_dict, params=params)
+        if response.status_code == 401:
+            self.authenticate(force = True)
+            with allowedTransport(self.insecure_transport):
+                response = request('sbanken', call, self.session, 'GET', f'{self.api_url}/{endpoint}', self.settings_dict, params=params)
+        return checkResponse(call, response).json()
+
+    # Returns the json reply of the Accounts endpoint, an overview of the accounts.
+    def accounts(self):
+        return self.get('Accounts')
+
+    # Returns the json reply of the Cards endpoint.
+    def cards(self):
+        return self.get('Cards')
+
+    # Returns the json reply of the Transactions endpoint for an account, with optional query parameters like
+    # startDate, endDate, index and length.
+    def transactions(self, account_id, **params):
+        return self.get(f'Transactions/{account_id}', params)
+
+    def close(self):
+        self.session.close()
+        return
+
+# oauthlib only allows plain http when the environment variable OAUTHLIB_INSECURE_TRANSPORT is set, which applies to
+# the whole process. The variable is therefore only set while a client allowing insecure transport is making a call,
+# and the number of such calls in progress is counted, so that it is removed again when the last one is done.
+insecure_calls = 0
+insecure_calls_lock = threading.Lock()
+insecure_previous = None
+
+# Context manager allowing plain http in oauthlib while it is active, if insecure is True.
+@contextlib.contextmanager
+def allowedTransport(insecure):
+    global insecure_calls, insecure_previous
+    if not insecure:
+        yield
+        return
+    with insecure_calls_lock:
+        if insecure_calls == 0:
+            insecure_previous = os.environ.get('OAUTHLIB_INSECURE_TRANSPORT')
+            os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        insecure_calls += 1
+    try:
+        yield
+    finally:
+        with insecure_calls_lock:
+            insecure_calls -= 1
+            if insecure_calls == 0:
+                if insecure_previous == None:
+                    del os.environ['OAUTHLIB_INSECURE_TRANSPORT']
+                else:
+                    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = insecure_previous
+
+# The clients created by getClient, one for each client id and set of URLs, so that the session and the token are
+# reused by all the calls in a run.
+sbanken_clients = {}
+clients_lock = threading.Lock()
+
+# Returns the shared SbankenClient for the credentials. The URLs are taken from the optional settings
+# "sbanken_auth_url" and "sbanken_api_url", and the timeouts and retries of the calls from settings_dict as well. Plain
+# http is only allowed with the setting "sbanken_insecure_transport", which is meant for the local stand-in server.
+def getClient(credentials, settings_dict = None):
+    settings_dict = settings_dict if settings_dict != None else {}
+    auth_url = settings_dict.get('sbanken_auth_url', AUTH_URL)
+    api_url = settings_dict.get('sbanken_api_url', API_URL)
+    insecure_transport = settings_dict.get('sbanken_insecure_transport', False)
+    client_id, _ = getCredentials(credentials)
+    with clients_lock:
+        key = (client_id, auth_url, api_url, insecure_transport)
+        if key not in sbanken_clients:
+            sbanken_clients[key] = SbankenClient(credentials, auth_url=auth_url, api_url=api_url, settings_dict=settings_dict,\
+                    insecure_transport=insecure_transport)
+        return sbanken_clients[key]
 
 
 # Read files to obtain credential information
@@ -59,11 +215,6 @@ def getCredentials(credentials, client_id_name = "sbanken_clientID", client_secr
 
     return client_id, client_secret
 
-# Call the Sbanken Accounts API and obtain an overview of the accounts. Returns json reply.
-def callAPI(session, api_url = 'https://publicapi.sbanken.no/apibeta/api/v2/Accounts'):
-    response_object = session.get(api_url)
-    return response_object.json()
-
 # Go through all balances and compute the total. The input is an Sbanken json object
 def calculateTotalBalance(response):
     balance = 0.0
@@ -76,32 +227,13 @@ def calculateTotalBalance(response):
 
     return balance
 
-# Get the total balance on the account given access to by the credentials by calling the Sbanken API
-def getTotalBalance(credentials):
-
-    # First we read credentials from files in the folder 'credentials'.
-    client_id, client_secret = getCredentials(credentials)
-
-    #print(client_id + "\n" + client_secret)
-
-    # URL-encode the client_id and client_secret.
-    urlencoded_id = urllib.parse.quote(client_id)
-    urlencoded_secret = urllib.parse.quote(client_secret)
-
-    # Authenticate to the Sbanken API.
-    session = getAuthenticatedSession(urlencoded_id, urlencoded_secret)
-    # Call the Accounts API endpoint to get account information
-    response = callAPI(session)
+# Get the total balance on the account given access to by the credentials by calling the Sbanken API. The URLs of the
+# API can be given in settings_dict (see getClient).
+def getTotalBalance(credentials, settings_dict = None):
+    client = getClient(credentials, settings_dict)
 
     # Sum the balance on the accounts returned.
-    total_balance = calculateTotalBalance(response)
-
-    # List cards
-#    card_api_url = "https://publicapi.sbanken.no/apibeta/api/v2/Cards"
-#    response = callAPI(session, api_url = card_api_url)
-#    pprint(response)
-
-    return total_balance
+    return calculateTotalBalance(client.accounts())
 
 
 
@@ -0,0 +1,169 @@
+# Here we collect a local stand-in for the Sbanken API, for testing sbanken_api.SbankenClient without a network
+# connection or real credentials. The server answers the token request of the OAuth2 "Backend Application Flow" and
+# the Accounts, Cards and Transactions endpoints with made up data, and counts the requests, so that it can be checked
+# how many times the client authenticates. The Transactions endpoint supports paging and date ranges like the real
+# one, for testing --sync (see sbanken_sync.py).
+#
+# Run it with
+#   python3 sbanken_mock_server.py [<port>]
+# and point the client to it with the settings
+#   "sbanken_auth_url" : "http://localhost:<port>", "sbanken_api_url" : "http://localhost:<port>/apibeta/api/v2",
+#   "sbanken_insecure_transport" : true
+# where the last one lets the client use plain http. Any client id and secret are accepted.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import copy
+import threading
+import secrets
+import time
+import json
+import sys
+import re
+
+DEFAULT_PORT = 8765
+TOKEN_PATH = "/identityserver/connect/token"
+API_PATH = "/apibeta/api/v2"
+TOKEN_LIFETIME = 3600
+
+ACCOUNTS = [
+    {'accountId' : 'A1', 'accountNumber' : '97100000001', 'name' : 'Brukskonto', 'accountType' : 'Standard account',\
+            'available' : 12500.50, 'balance' : 12500.50},
+    {'accountId' : 'A2', 'accountNumber' : '97100000002', 'name' : 'Kredittkort', 'accountType' : 'Creditcard account',\
+            'available' : 20000.0, 'balance' : -1520.25},
+]
+
+CARDS = [
+    {'cardId' : 'C1', 'accountNumber' : '97100000001', 'cardType' : 'Debit', 'status' : 'Active'},
+]
+
+# The archive references are the ones in the ARKIVREF column of the csv files, while the transaction ids are only
+# known to the API.
+TRANSACTIONS = {
+    'A1' : [
+        {'accountingDate' : '2023-02-01T00:00:00', 'interestDate' : '2023-02-01T00:00:00', 'amount' : -52.91,\
+                'text' : 'REMA 1000 MAJORSTUEN', 'transactionTypeText' : 'VARER', 'transactionId' : '5f1c0a7e-0001',\
+                'archiveReference' : '786013394'},
+        {'accountingDate' : '2023-02-02T00:00:00', 'interestDate' : '2023-02-02T00:00:00', 'amount' : 35000.0,\
+                'text' : 'LØNN', 'transactionTypeText' : 'LØNN', 'transactionId' : '5f1c0a7e-0002',\
+                'archiveReference' : '786013395'},
+    ],
+    'A2' : [
+        {'accountingDate' : '2023-02-03T00:00:00', 'interestDate' : '2023-02-03T00:00:00', 'amount' : -599.20,\
+                'text' : 'KIWI 505', 'transactionTypeText' : 'VARER', 'transactionId' : '5f1c0a7e-0003',\
+                'archiveReference' : '791464264'},
+    ],
+}
+
+
+class MockSbankenHandler(BaseHTTPRequestHandler):
+    # Token requests: answers with a new bearer token, which is remembered by the server.
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.path != TOKEN_PATH:
+            self.reply(404, {'error' : 'not found'})
+            return
+        token = secrets.token_hex(16)
+        with self.server.lock:
+            self.server.token_requests += 1
+            self.server.tokens.add(token)
+        self.reply(200, {'access_token' : token, 'token_type' : 'Bearer', 'expires_in' : TOKEN_LIFETIME})
+
+    # API requests: answers if the request has a token given by the server.
+    def do_GET(self):
+        with self.server.lock:
+            self.server.api_requests += 1
+            authorized = self.headers.get('Authorization', '').replace('Bearer ', '') in self.server.tokens
+            failing = self.server.failures > 0
+            self.server.failures = max(self.server.failures - 1, 0)
+        if self.server.delay > 0:
+            time.sleep(self.server.delay)
+        if failing:
+            self.reply(503, {'error' : 'service unavailable'})
+            return
+        if not authorized:
+            self.reply(401, {'error' : 'invalid token'})
+            return
+
+        path = self.path.split('?')[0]
+        if path == f"{API_PATH}/Accounts":
+            self.reply(200, {'availableItems' : len(ACCOUNTS), 'items' : ACCOUNTS})
+        elif path == f"{API_PATH}/Cards":
+            self.reply(200, {'availableItems' : len(CARDS), 'items' : CARDS})
+        elif re.fullmatch(f"{API_PATH}/Transactions/[^/]+", path):
+            items = self.server.transactions.get(path.split('/')[-1])
+            if items == None:
+                self.reply(404, {'error' : 'unknown account'})
+            else:
+                self.replyPage(items, parse_qs(urlparse(self.path).query))
+        else:
+            self.reply(404, {'error' : 'not found'})
+
+    # Answers with the page of the transactions between the query parameters startDate and endDate (YYYY-MM-DD) given
+    # by index and length, like the Transactions endpoint.
+    def replyPage(self, items, query):
+        start_date = query.get('startDate', ['0000-00-00'])[0]
+        end_date = query.get('endDate', ['9999-99-99'])[0]
+        index = int(query.get('index', ['0'])[0])
+        length = int(query.get('length', ['100'])[0])
+        items = [item for item in items if start_date <= item['accountingDate'][:10] <= end_date]
+        with self.server.lock:
+            self.server.pages += 1
+        self.reply(200, {'availableItems' : len(items), 'items' : items[index:index + length]})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # The requests are not logged, to keep the output of the tests clean.
+    def log_message(self, format, *args):
+        return
+
+# Returns a server on the given port, or on a free port if it is 0. The server counts the requests in token_requests
+# and api_requests, and the pages of transactions in pages. The transactions of each account are in the dictionary
+# transactions, where transactions can be added while the server is running. To test how the client handles an
+# unreliable API (see http_client.py), the next failures API requests are answered with 503, and every API request
+# is delayed by delay seconds.
+def createMockServer(port = 0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockSbankenHandler)
+    server.lock = threading.Lock()
+    server.tokens = set()
+    server.token_requests = 0
+    server.api_requests = 0
+    server.pages = 0
+    server.failures = 0
+    server.delay = 0
+    server.transactions = copy.deepcopy(TRANSACTIONS)
+    return server
+
+# Starts a server (see createMockServer) in a background thread and returns it. Stop it with server.shutdown().
+def startMockServer(port = 0):
+    server = createMockServer(port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Returns the settings pointing the Sbanken client to a running mock server over plain http.
+def mockSettings(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    return {'sbanken_auth_url' : url, 'sbanken_api_url' : f"{url}{API_PATH}", 'sbanken_insecure_transport' : True}
+
+def main(argv):
+    port = int(argv[0]) if len(argv) > 0 else DEFAULT_PORT
+    server = createMockServer(port)
+    settings = mockSettings(server)
+    print(f"Mock Sbanken API running. Use the settings\n  \"sbanken_auth_url\" : \"{settings['sbanken_auth_url']}\",")
+    print(f"  \"sbanken_api_url\" : \"{settings['sbanken_api_url']}\",")
+    print("  \"sbanken_insecure_transport\" : true")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
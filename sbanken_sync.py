@@ -0,0 +1,168 @@
+# Here we collect the functions for getting transactions directly from the Transactions endpoint of the Sbanken API
+# with --sync, as an alternative to exporting csv files by hand. The transactions of each account are fetched page by
+# page and converted to the same Transaction records as the lines of the csv files (see accounting_data.py), so that
+# they go through the same categorization as imported files. The accounts are fetched concurrently, each in a
+# background thread staying at most PAGES_AHEAD pages ahead of the categorization, so that only a few pages of each
+# account are held in memory at a time.
+#
+# The date of the latest transaction synced from each account, its high-water mark, is kept in the file
+# sync_state.json next to the results files. The next sync starts at this date, so only the transactions since the
+# last sync are fetched. Transactions of the day of the high-water mark are fetched again, since more of them may
+# have been booked later that day, and are left out by the transaction index (see transaction_index.py). The first
+# sync of an account starts at the optional setting "sync_start_date" (YYYY-MM-DD), or the start of the current month.
+
+from accounting_data import Transaction
+from aux_functions import saveDictToJson
+from datetime import datetime
+import threading
+import queue
+import json
+import os
+
+SYNC_STATE_FILENAME = 'sync_state.json'
+DEFAULT_PAGE_LENGTH = 1000
+DATE_FORMAT = '%Y-%m-%d'
+PAGES_AHEAD = 2
+# Put in the queue of prefetched pages when all the pages have been fetched.
+LAST_PAGE = None
+
+
+class SyncState:
+    def __init__(self, path = SYNC_STATE_FILENAME):
+        self.path = path
+        # Dictionary of account ids with the dates of their high-water marks as values.
+        self.marks = {}
+        # High-water marks moved since the state was loaded. They are only stored by save, once the synced
+        # transactions have been saved.
+        self.new_marks = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.marks = {account_id : datetime.strptime(date, DATE_FORMAT) for account_id, date in json.load(f)['accounts'].items()}
+
+    # Returns the date of the high-water mark of an account, or None if it has not been synced before.
+    def mark(self, account_id):
+        return self.new_marks.get(account_id, self.marks.get(account_id))
+
+    # Moves the high-water mark of an account forward to date.
+    def update(self, account_id, date):
+        mark = self.mark(account_id)
+        if mark == None or date > mark:
+            self.new_marks[account_id] = date
+        return
+
+    # Writes the high-water marks to the json file.
+    def save(self):
+        self.marks.update(self.new_marks)
+        self.new_marks = {}
+        saveDictToJson({'accounts' : {account_id : date.strftime(DATE_FORMAT) for account_id, date in self.marks.items()}}, self.path)
+        return
+
+# Converts a transaction from the Sbanken API into a Transaction. Only the date of the booking and interest dates is
+# kept, as in the csv files. The archive reference is the same as in the ARKIVREF column of the csv files, so that a
+# transaction gets the same fingerprint in the transaction index whether it was synced or imported from a csv file.
+def transactionFromAPI(item):
+    date_book = datetime.fromisoformat(item['accountingDate']).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    date_rent = datetime.fromisoformat(item.get('interestDate') or item['accountingDate']).replace(hour=0, minute=0,\
+            second=0, microsecond=0, tzinfo=None)
+    ore = round(item['amount'] * 100)
+    out_ore = -ore if ore < 0 else 0
+    in_ore = ore if ore > 0 else 0
+    return Transaction(date_book, date_rent, item.get('otherAccountNumber') or '', item.get('transactionTypeText', ''),\
+            item['text'], out_ore, in_ore, str(item.get('archiveReference') or ''))
+
+# Generator yielding the booked transactions of an account from start_date to end_date as lists of Transactions, one
+# list for each page fetched from the Transactions endpoint with a SbankenClient (see sbanken_api.py). Reservations
+# are left out, since they have not been booked yet.
+def iterAccountPages(client, account_id, start_date, end_date, page_length = DEFAULT_PAGE_LENGTH):
+    index = 0
+    while True:
+        page = client.transactions(account_id, startDate=start_date.strftime(DATE_FORMAT), endDate=end_date.strftime(DATE_FORMAT),\
+                index=index, length=page_length)
+        items = page['items']
+        yield [transactionFromAPI(item) for item in items if not item.get('isReservation', False)]
+        index += len(items)
+        if len(items) == 0 or index >= page['availableItems']:
+            break
+    return
+
+# Starts getting the pages of pages (e.g. from iterAccountPages) in a background thread, which stays at most ahead pages
+# ahead of the returned generator yielding the transactions of the pages. An exception raised while fetching is
+# raised by the generator. If the generator is closed before the last page, the thread stops as well.
+def prefetchPages(pages, ahead = PAGES_AHEAD):
+    buffer = queue.Queue(maxsize=ahead)
+    stop = threading.Event()
+
+    def fetch():
+        try:
+            for page in pages:
+                if not putUnlessStopped(buffer, page, stop):
+                    return
+            putUnlessStopped(buffer, LAST_PAGE, stop)
+        except Exception as e:
+            putUnlessStopped(buffer, e, stop)
+        return
+
+    def iterTransactions():
+        try:
+            while True:
+                page = buffer.get()
+                if page is LAST_PAGE:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+        finally:
+            stop.set()
+
+    # The thread does not keep the program running if the transactions are never used, e.g. after an error.
+    threading.Thread(target=fetch, daemon=True).start()
+    return iterTransactions()
+
+# Puts item in a full queue as soon as there is room, unless stop is set first. Returns True if the item was put.
+def putUnlessStopped(buffer, item, stop):
+    while not stop.is_set():
+        try:
+            buffer.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+# Generator passing the transactions of an account through while moving its high-water mark in state to the latest
+# of them.
+def trackHighWaterMark(transactions, state, account_id):
+    for transaction in transactions:
+        state.update(account_id, transaction.date_book)
+        yield transaction
+    return
+
+# Returns the date the sync of an account starts at: its high-water mark, or the setting "sync_start_date" or the
+# start of the current month if it has not been synced before.
+def syncStartDate(account_id, state, settings_dict):
+    mark = state.mark(account_id)
+    if mark != None:
+        return mark
+    if 'sync_start_date' in settings_dict:
+        return datetime.strptime(settings_dict['sync_start_date'], DATE_FORMAT)
+    return datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+# Starts fetching the transactions of an account since its high-water mark in state up to end_date, and returns a
+# generator yielding them (see prefetchPages). The high-water mark is moved forward as the transactions are used.
+def fetchAccountTransactions(client, account_id, state, settings_dict, end_date):
+    start_date = syncStartDate(account_id, state, settings_dict)
+    page_length = settings_dict.get('sync_page_length', DEFAULT_PAGE_LENGTH)
+    pages = iterAccountPages(client, account_id, start_date, end_date, page_length)
+    return trackHighWaterMark(prefetchPages(pages), state, account_id)
+
+# Starts fetching the transactions of all the accounts since their high-water marks in state concurrently. Returns a
+# list of (account name, transactions) tuples in the order of the accounts, where the transactions are generators
+# yielding the transactions as they arrive. The high-water marks are moved to the latest transaction of each
+# account as the transactions are used, but not saved.
+def fetchNewTransactions(client, state, settings_dict):
+    accounts = client.accounts()['items']
+    end_date = datetime.now()
+    synced = []
+    for account in accounts:
+        name = f"Sbanken account {account.get('name', '')} ({account.get('accountNumber', account['accountId'])})"
+        synced.append((name, fetchAccountTransactions(client, account['accountId'], state, settings_dict, end_date)))
+    return synced
@@ -0,0 +1,70 @@
+# Here we collect the functions concerning the transaction index, which keeps track of all the transactions that
+# have been imported into results files. Importing the same CSV file twice, or two exports covering overlapping
+# periods, would otherwise count the same transactions several times.
+#
+# Each transaction is identified by a fingerprint, which is a hash of its booking date, amounts, text and archive
+# reference together with the number of identical transactions seen before it in the same import. The latter makes
+# it possible to tell apart e.g. two identical purchases on the same day, while still recognizing both of them when
+# they appear again in an overlapping export. The fingerprints are stored in a json file next to the results files.
+
+from aux_functions import saveDictToJson
+import hashlib
+import json
+import os
+
+
+class TransactionIndex:
+    def __init__(self, path = 'transaction_index.json'):
+        self.path = path
+        self.fingerprints = set()
+        # Fingerprints added since the index was loaded.
+        self.new_fingerprints = set()
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.fingerprints = set(json.load(f)['fingerprints'])
+
+    # Returns True if a fingerprint is in the index.
+    def contains(self, fingerprint):
+        return fingerprint in self.fingerprints or fingerprint in self.new_fingerprints
+
+    # Generator that yields the transactions in accounting_data that are not already in the index, and adds their
+    # fingerprints to the index. If skip_known is False all the transactions are yielded, but still added.
+    def filterNew(self, accounting_data, skip_known = True):
+        occurrences = {}
+        for line in accounting_data:
+            key = transactionKey(line)
+            occurrence = occurrences.get(key, 0)
+            occurrences[key] = occurrence + 1
+
+            fingerprint = transactionFingerprint(key, occurrence)
+            if self.contains(fingerprint):
+                if skip_known:
+                    continue
+            else:
+                self.new_fingerprints.add(fingerprint)
+            yield line
+        return
+
+    # Returns the number of fingerprints in a set that are already in the index.
+    def countKnown(self, fingerprints):
+        return len([fingerprint for fingerprint in fingerprints if self.contains(fingerprint)])
+
+    # Adds a set of fingerprints, e.g. the new fingerprints of a copy of the index used in another process.
+    def merge(self, fingerprints):
+        self.new_fingerprints |= fingerprints
+        return
+
+    # Writes the index to its json file.
+    def save(self):
+        self.fingerprints |= self.new_fingerprints
+        self.new_fingerprints = set()
+        saveDictToJson({'fingerprints' : sorted(self.fingerprints)}, self.path)
+        return
+
+# Returns a string identifying a transaction from its booking date, amounts, text and archive reference.
+def transactionKey(transaction):
+    return f"{transaction.date_book.date().isoformat()}|{transaction.out_ore}|{transaction.in_ore}|{transaction.text}|{transaction.archive_ref}"
+
+# Hashes a transaction key together with the number of identical transactions seen before it.
+def transactionFingerprint(key, occurrence):
+    return hashlib.sha1(f"{key}|{occurrence}".encode()).hexdigest()[:20]